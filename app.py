@@ -3,7 +3,10 @@
     included in this folder.
 """
 import base64
+import math
+import os
 import time
+import uuid
 import warnings
 from datetime import timedelta
 from io import BytesIO
@@ -12,6 +15,7 @@ from itertools import chain
 import dash
 import dash_bootstrap_components as dbc
 import dash_cytoscape as cyto
+import flask
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objs as go
@@ -20,11 +24,13 @@ from dash import dcc
 from dash import html
 from dash.dependencies import Input, Output
 from dash.dependencies import State, ALL
+from dash.exceptions import PreventUpdate
 from elasticsearch.exceptions import ElasticsearchWarning
 
-from functions import extreme_dates, docs_per_periode, data_table, iterate_whole_es, docs_per_source, plot_wordcloud, \
+from functions import extreme_dates, docs_per_periode, reduced_scroll, docs_per_source, plot_wordcloud, \
     significant_words, data_for_map_chart, tokens_size, data_for_bubble_chart, count_articles, cytoscape_data, \
-    locations_processing
+    locations_processing, exists_index, top_locations, query_cache, table_query, table_sort, table_page, \
+    TABLE_PAGE_SIZE, top_daily_tokens, latest_requests, run_unless_cancelled, QueryCancelled
 
 start_time = time.time()
 
@@ -40,6 +46,13 @@ index_name = "livrons_journaux"
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
 server = app.server
 
+
+# Counters of the cache of the Elasticsearch queries (hits, misses ...)
+@server.route("/cache-stats")
+def cache_stats():
+    return flask.jsonify(query_cache.stats())
+
+
 # ################################# CYTOSCAPE STYLESHEET ##############################################################
 # Default stylesheet for cytoscape graph components (nodes and edges)
 default_stylesheet = [
@@ -64,38 +77,84 @@ default_stylesheet = [
 
 
 # ################################# LIVE GRAPH DATA ###################################################################
-def static_vars(**kwargs):
+# Number of points displayed by the live graph (the oldest points are removed by the browser)
+LIVE_GRAPH_MAX_POINTS = 40
+
+
+def live_graph_data(start_date, end_date):
     """
-        function to declare a static variable
+        function to get the number of articles of each day of the index, the data is loaded from Elasticsearch once
+        per page (in serve_layout) and kept by the page in the live_graph_data store
+        :param start_date: first date of the index
+        :param end_date: last date of the index
+        -> returns a dict {'date': list of the days, 'nb': list of the numbers of articles}
     """
+    data = docs_per_periode(start_date, end_date, "day", index_name)
+    return {'date': [str(day) for day in data['date']], 'nb': [int(nb) for nb in data['nb']]}
 
-    def decorate(func):
-        for k in kwargs:
-            setattr(func, k, kwargs[k])
-        return func
 
-    return decorate
+def live_graph_figure(graph_type, position, data):
+    """
+        function to build the live graph with the points displayed before a position, the next points are sent one by
+        one with the extendData property of the graph
+        :param graph_type: Bar or Scatter
+        :param position: index of the next point of the data
+        :param data: dict {'date': ..., 'nb': ...} returned by live_graph_data
+    """
+    live_graph_dates = data['date']
+    nb_articles = data['nb']
+    first = max(0, position - LIVE_GRAPH_MAX_POINTS)
+    figure = {
+        'data': []
+    }
 
+    # The data part of the graph is created according to the requested type
+    if graph_type == 'Bar':
+        figure['data'].append(
+            go.Bar(
+                y=list(nb_articles[first:position]),
+                x=list(live_graph_dates[first:position]),
+                marker=dict(color='#09142F'),
+                hoverinfo='text',
+            ),
+        )
+    else:
+        figure['data'].append(
+            go.Scatter(
+                y=list(nb_articles[first:position]),
+                x=list(live_graph_dates[first:position]),
+                mode='markers+lines',
+                line=dict(width=3, color='#09142F'),
+                marker=dict(size=6, symbol='circle', color='#09142F'),
+                hoverinfo='text',
+            ),
+        )
 
-# Get data from Elasticsearch
-live_graph_data = docs_per_periode(extreme_dates(index_name)[0], extreme_dates(index_name)[1], "day", index_name)
-live_graph_dates = live_graph_data['date']
-nb_articles = live_graph_data['nb']
+    # The y-axis is set to the maximum value of the data or to 200 if this is greater, the whole data is used since the
+    # layout is not updated when the points are added
+    maximum = max(nb_articles) if len(nb_articles) else 0
 
-# Data transmitted to live graph, updatable every 500ms
-database = {
-    'date': [],
-    'nb': []
-}
+    # Layout part of the graph
+    figure['layout'] = go.Layout(
+        margin=dict(t=30, r=40, l=50, b=50),
 
+        xaxis=dict(showline=False,
+                   showgrid=False,
+                   showticklabels=True,
+                   linecolor='#808283',
+                   tickfont=dict(size=11, color='#808283')
+                   ),
 
-def update_database(value):
-    """
-        function that adds a new value to the graph data at each call
-        :param value: index of a line in live_graph_dates dataframe
-    """
-    database['date'].append(live_graph_dates[value])
-    database['nb'].append(nb_articles[value])
+        yaxis=dict(range=[0, max(200, maximum)],
+                   color='#808283',
+                   showline=False,
+                   showgrid=True,
+                   showticklabels=True,
+                   linecolor='#808283',
+                   tickfont=dict(size=11, color='#808283')
+                   ),
+    )
+    return figure
 
 
 # ############################################## APPLICATION LAYOUT ###################################################
@@ -104,257 +163,291 @@ app.title = "Article analysis"
 
 # Define the layout property of the app object, it's a tree of dash components:  Dash HTML components provide python
 # wrappers for HTML elements, and Dash Core components provide python abstractions for creating interactive user
-# interfaces
-app.layout = html.Div((
-
-    # header of the app
-    html.Div([
-        html.H1(children="Article Analysis Dashboard", className="header-title"),
-        html.P(
-            children="Analyse the evolution of the number of articles published in each period of time, and their "
-                     "compositions in words (persons, organizations and places) through several types of graphs.",
-            className="header-description"
-        ),
-    ],
-        className="header"
-    ),
+# interfaces. The layout is built at each page load, so that each page gets its own session id, and so that no query is
+# sent to Elasticsearch when the application starts
+def serve_layout():
+    """
+        Function to build the layout of the page, with a new session id
+    """
+    # Extreme dates of the index, computed once for the two date pickers (and cached between the pages)
+    date_min, date_max = extreme_dates(index_name)
+
+    return html.Div((
+
+        # id of the session of the page, used to cancel the queries superseded by a newer query of the same page
+        dcc.Store(id='session-id', data=str(uuid.uuid4())),
 
-    html.Div([
+        # header of the app
         html.Div([
+            html.H1(children="Article Analysis Dashboard", className="header-title"),
+            html.P(
+                children="Analyse the evolution of the number of articles published in each period of time, and their "
+                         "compositions in words (persons, organizations and places) through several types of graphs.",
+                className="header-description"
+            ),
+        ],
+            className="header"
+        ),
 
-            # radioItems (line graph/bar graph) + Restart button
+        html.Div([
             html.Div([
-                dcc.RadioItems(
-                    id='menu_radioItems',
-                    options=[
-                        {'label': 'Line chart  ', 'value': 'Scatter'},
-                        {'label': 'Bar chart', 'value': 'Bar'},
-                    ],
-                    value='Scatter',
-                    inline=True,
-                    className='menu-title'
-                ),
-                html.Button('Restart', id='restart_button', style={'margin-left': '1170px'}),
-            ], className='row flex-display'),
 
-            # live graph
-            dcc.Interval(id='interval', interval=500),
-            dcc.Graph(id='live_graph', config={'displayModeBar': False}, style={'height': '240px'}),
+                # radioItems (line graph/bar graph) + Restart button
+                html.Div([
+                    dcc.RadioItems(
+                        id='menu_radioItems',
+                        options=[
+                            {'label': 'Line chart  ', 'value': 'Scatter'},
+                            {'label': 'Bar chart', 'value': 'Bar'},
+                        ],
+                        value='Scatter',
+                        inline=True,
+                        className='menu-title'
+                    ),
+                    html.Button('Restart', id='restart_button', style={'margin-left': '1170px'}),
+                ], className='row flex-display'),
+
+                # live graph, the data of the graph (loaded once) and the position of the next point are kept by
+                # each page
+                dcc.Interval(id='interval', interval=500),
+                dcc.Store(id='live_graph_position', data=0),
+                dcc.Store(id='live_graph_data', data=live_graph_data(date_min, date_max)),
+                dcc.Graph(id='live_graph', config={'displayModeBar': False}, style={'height': '240px'}),
 
-        ], className='create_container2', style={'width': '1510px', 'height': '250px', 'background-color': '#FFFFFF'}),
-    ], className="row flex-display"),
+            ], className='create_container2',
+                style={'width': '1510px', 'height': '250px', 'background-color': '#FFFFFF'}),
+        ], className="row flex-display"),
 
-    html.Div([
         html.Div([
-            # Dropdown element for time periods
             html.Div([
-                html.Div(children="Time period", className="menu-title"),
-                dcc.Dropdown(
-                    id="interval-time",
-                    options=[
-                        {"label": interval_time, "value": interval_time}
-                        for interval_time in ["day", "week", "month", "year"]
-                    ],
-                    value="week",
-                    clearable=True,
-                    style={
-                        'height': '40px',
-                        'width': '287px'
-                    },
-                ),
-            ], className="menu"),
+                # Dropdown element for time periods
+                html.Div([
+                    html.Div(children="Time period", className="menu-title"),
+                    dcc.Dropdown(
+                        id="interval-time",
+                        options=[
+                            {"label": interval_time, "value": interval_time}
+                            for interval_time in ["day", "week", "month", "year"]
+                        ],
+                        value="week",
+                        clearable=True,
+                        style={
+                            'height': '40px',
+                            'width': '287px'
+                        },
+                    ),
+                ], className="menu"),
+
+                # Date range
+                html.Div([
+                    html.Div(children="Date range", className="menu-title"),
+                    dcc.DatePickerRange(
+                        id="date-range",
+                        display_format='MMM Do, YYYY',
+                        min_date_allowed=date_min,
+                        max_date_allowed=date_max,
+                        start_date=date_min,
+                        end_date=date_max,
+                        style={
+                            'height': '40px',
+                            'width': '287px'
+                        },
+                    ),
+                ], className="menu"),
+
+                # Input label for search term + Submit button
+                html.Div([
+                    html.Div(children="Search term", className="menu-title"),
+                    dbc.Input(
+                        id="filter",
+                        placeholder='Enter a word...',
+                        value="",
+                        type='text',
+                        style={
+                            'height': '40px',
+                            'width': '287px'
+                        },
+                    ),
+                    html.Button('OK', id='submit-val', n_clicks=0,
+                                style={'margin': " 3px 0px 3px 205px", 'color': "#09142F"}),
+                ], className="menu", style={'height': '100px'}),
+
+                # Label for the number of articles
+                html.Div(id='nb_articles', className='menu', style={'height': '35px', 'padding-top': '15px'}),
 
-            # Date range
-            html.Div([
-                html.Div(children="Date range", className="menu-title"),
-                dcc.DatePickerRange(
-                    id="date-range",
-                    display_format='MMM Do, YYYY',
-                    min_date_allowed=extreme_dates(index_name)[0],
-                    max_date_allowed=extreme_dates(index_name)[1],
-                    start_date=extreme_dates(index_name)[0],
-                    end_date=extreme_dates(index_name)[1],
-                    style={
-                        'height': '40px',
-                        'width': '287px'
-                    },
-                ),
-            ], className="menu"),
+            ], className='create_container2',
+                style={'width': '500px', 'height': '400px', 'background-color': '#FFFFFF', 'padding': '0'}),
 
-            # Input label for search term + Submit button
+            # Bar chart
             html.Div([
-                html.Div(children="Search term", className="menu-title"),
-                dbc.Input(
-                    id="filter",
-                    placeholder='Enter a word...',
-                    value="",
-                    type='text',
-                    style={
-                        'height': '40px',
-                        'width': '287px'
-                    },
-                ),
-                html.Button('OK', id='submit-val', n_clicks=0,
-                            style={'margin': " 3px 0px 3px 205px", 'color': "#09142F"}),
-            ], className="menu", style={'height': '100px'}),
-
-            # Label for the number of articles
-            html.Div(id='nb_articles', className='menu', style={'height': '35px', 'padding-top': '15px'}),
+                dcc.Loading(dcc.Graph(id='bar_chart',
+                                      config={'displayModeBar': 'hover'}, style={'height': '370px'}),
+                            type='dot'),
 
-        ], className='create_container2',
-            style={'width': '500px', 'height': '400px', 'background-color': '#FFFFFF', 'padding': '0'}),
+            ], className='create_container2 three columns', style={'height': '400px'}),
 
-        # Bar chart
-        html.Div([
-            dcc.Loading(dcc.Graph(id='bar_chart',
-                                  config={'displayModeBar': 'hover'}, style={'height': '370px'}),
-                        type='dot'),
+            # Line chart
+            html.Div([
+                dcc.Loading(
+                    dcc.Graph(id='line_chart', config={'displayModeBar': 'hover'}, style={'height': '350px'}),
+                    type='dot'
+                ),
 
-        ], className='create_container2 three columns', style={'height': '400px'}),
+            ], className='create_container2 three columns', style={'height': '400px'}),
+        ], className="row flex-display"),
 
-        # Line chart
-        html.Div([
-            dcc.Loading(
-                dcc.Graph(id='line_chart', config={'displayModeBar': 'hover'}, style={'height': '350px'}),
-                type='dot'
-            ),
+        html.Div((
+            # Pie chart
+            html.Div([
+                dcc.Loading(
+                    dcc.Graph(id='pie_chart', config={'displayModeBar': 'hover'}, style={'height': '350px'}
+                              ),
+                    type='dot'),
 
-        ], className='create_container2 three columns', style={'height': '400px'}),
-    ], className="row flex-display"),
+            ], className='create_container2 two columns', style={'height': '400px', 'width': '600px'}),
 
-    html.Div((
-        # Pie chart
-        html.Div([
-            dcc.Loading(
-                dcc.Graph(id='pie_chart', config={'displayModeBar': 'hover'}, style={'height': '350px'}
-                          ),
-                type='dot'),
+            # Data table
+            html.Div([
+                dt.DataTable(id='datatable',
+                             columns=[{'name': i, 'id': i} for i in ["Title", "Date", "Time", "Link"]],
+                             page_action="custom",
+                             page_current=0,
+                             page_size=TABLE_PAGE_SIZE,
+                             sort_action="custom",
+                             sort_mode="single",
+                             sort_by=[],
+                             style_cell={'textAlign': 'left',
+                                         'min-width': '90px',
+                                         'backgroundColor': '#E8F1F4',
+                                         'border-bottom': '0.01rem solid #808283',
+                                         },
+                             style_as_list_view=True,
+                             style_header={
+                                 'textAlign': 'center',
+                                 'backgroundColor': '#09142F',
+                                 'font-weight': 'bold',
+                                 'color': '#FFFFFF'
+                             },
+                             style_data={'textOverflow': 'hidden', 'color': 'black'},
+                             fixed_rows={'headers': True},
+                             style_table={'max-height': '300px', 'min-width': '800px'}
+                             ),
+            ], className='create_container2 two columns', style={'min-width': '900px', 'min-height': '400px'})
+        ), className="row flex-display"),
+
+        html.Div((
+            # Map chart
+            html.Div([
+                dcc.Loading(
+                    dcc.Graph(id='map_chart', config={'displayModeBar': 'hover'}),
+                    type='dot'
+                ),
+            ], className='create_container2 two columns',
+                style={'width': '800px', 'height': '450px', 'padding': '0px'}),
 
-        ], className='create_container2 two columns', style={'height': '400px', 'width': '600px'}),
+            # Word cloud
+            html.Div([
+                dcc.Loading(
+                    html.Img(id="word_cloud"),
+                    type='dot'
+                ),
+            ], className='create_container2 two columns', style={'height': '450px', 'width': '700px',
+                                                                 'background-color': '#FFFFFF', 'padding-right': '0px'}),
+        ), className="row flex-display"),
 
-        # Data table
-        html.Div([
-            dt.DataTable(id='datatable',
-                         columns=[{'name': i, 'id': i} for i in ["Title", "Date", "Time", "Link"]],
-                         sort_action="native",
-                         sort_mode="multi",
-                         style_cell={'textAlign': 'left',
-                                     'min-width': '90px',
-                                     'backgroundColor': '#E8F1F4',
-                                     'border-bottom': '0.01rem solid #808283',
-                                     },
-                         style_as_list_view=True,
-                         style_header={
-                             'textAlign': 'center',
-                             'backgroundColor': '#09142F',
-                             'font-weight': 'bold',
-                             'color': '#FFFFFF'
-                         },
-                         style_data={'textOverflow': 'hidden', 'color': 'black'},
-                         fixed_rows={'headers': True},
-                         style_table={'max-height': '300px', 'min-width': '800px'}
-                         ),
-        ], className='create_container2 two columns', style={'min-width': '900px', 'min-height': '400px'})
-    ), className="row flex-display"),
-
-    html.Div((
-        # Map chart
-        html.Div([
-            dcc.Loading(
-                dcc.Graph(id='map_chart', config={'displayModeBar': 'hover'}),
-                type='dot'
-            ),
-        ], className='create_container2 two columns', style={'width': '800px', 'height': '450px', 'padding': '0px'}),
+        # Range slider
+        html.Div((
+            html.Div([
+                html.Div(children='Select Week(s)', className='menu-title'),
+                html.Div(id='range_slider_container', children=[])
+            ], className='create_container2 two columns',
+                style={'width': '1510px', 'height': '150px', 'background-color': '#FFFFFF'}),
+        ), className="row flex-display"),
+
+        # Word graph
+        html.Div((
+            html.Div([
+                dcc.Loading(
+                    dcc.Graph(id='bubble_chart', config={'displayModeBar': 'hover'}, style={'height': '370px'}),
+                    type='dot'
+                ),
+            ], className='create_container2 two columns', style={'width': '1510px', 'height': '400px'}),
+        ), className="row flex-display"),
 
-        # Word cloud
+        # Network graph part 
         html.Div([
-            dcc.Loading(
-                html.Img(id="word_cloud"),
-                type='dot'
-            ),
-        ], className='create_container2 two columns', style={'height': '450px', 'width': '700px',
-                                                             'background-color': '#FFFFFF', 'padding-right': '0px'}),
-    ), className="row flex-display"),
+            html.P(children="Network graph", className="header-title", style={'font-size': '20px'})
+        ], className='header', style={'height': '60px'}),
 
-    # Range slider
-    html.Div((
-        html.Div([
-            html.Div(children='Select Week(s)', className='menu-title'),
-            html.Div(id='range_slider_container', children=[])
-        ], className='create_container2 two columns',
-            style={'width': '1510px', 'height': '150px', 'background-color': '#FFFFFF'}),
-    ), className="row flex-display"),
-
-    # Word graph
-    html.Div((
-        html.Div([
-            dcc.Loading(
-                dcc.Graph(id='bubble_chart', config={'displayModeBar': 'hover'}, style={'height': '370px'}),
-                type='dot'
-            ),
-        ], className='create_container2 two columns', style={'width': '1510px', 'height': '400px'}),
-    ), className="row flex-display"),
-
-    # Network graph part 
-    html.Div([
-        html.P(children="Network graph", className="header-title", style={'font-size': '20px'})
-    ], className='header', style={'height': '60px'}),
-
-    html.Div([
         html.Div([
             html.Div([
                 html.Div([
-                    html.P(children="Date of a day", className="menu-title"),
-                    dcc.DatePickerSingle(
-                        id='date-picker-single',
-                        display_format='MMM Do, YYYY',
-                        min_date_allowed=extreme_dates(index_name)[0],
-                        max_date_allowed=extreme_dates(index_name)[1],
-                        date=extreme_dates(index_name)[1]
-                    )], className="menu",
-                ),
+                    html.Div([
+                        html.P(children="Date of a day", className="menu-title"),
+                        dcc.DatePickerSingle(
+                            id='date-picker-single',
+                            display_format='MMM Do, YYYY',
+                            min_date_allowed=date_min,
+                            max_date_allowed=date_max,
+                            date=date_max
+                        )], className="menu",
+                    ),
+
+                    html.Div([
+                        html.P(children="Choose nodes type", className="menu-title"),
+                        dcc.Dropdown(
+                            id='dropdown-update-elements',
+                            value=[0],
+                            multi=True,
+                            options=[
+                                {'label': data, 'value': i}
+                                for i, data in
+                                enumerate(['organizations → persons', 'locations → organizations', 'persons → locations'])
+                            ]
+                        ),
+                        html.P(children="Link the nodes mentioned in the same", className="menu-title"),
+                        dcc.RadioItems(
+                            id='cooccurrence-mode',
+                            options=[
+                                {'label': 'day  ', 'value': 'day'},
+                                {'label': 'article', 'value': 'article'},
+                            ],
+                            value='day',
+                            inline=True,
+                        )], className="menu", style={'height': "175px"},
+                    )
+                ], className='create_container2',
+                    style={'width': '500px', 'height': '400px', 'background-color': '#FFFFFF', 'padding': '0'}),
 
                 html.Div([
-                    html.P(children="Choose nodes type", className="menu-title"),
-                    dcc.Dropdown(
-                        id='dropdown-update-elements',
-                        value=[0],
-                        multi=True,
-                        options=[
-                            {'label': data, 'value': i}
-                            for i, data in
-                            enumerate(['organizations → persons', 'locations → organizations', 'persons → locations'])
-                        ]
-                    )], className="menu", style={'height': "175px"},
-                )
-            ], className='create_container2',
-                style={'width': '500px', 'height': '400px', 'background-color': '#FFFFFF', 'padding': '0'}),
+                    html.P(children="Node information", className="menu-title"),
+                    dcc.Markdown(id='tap-node-json-output',
+                                 style={'overflow-y': 'scroll', 'height': 'calc(100% - 25px)'}),
+                ], className='create_container2 three columns', style={'height': '300px'}),
 
-            html.Div([
-                html.P(children="Node information", className="menu-title"),
-                dcc.Markdown(id='tap-node-json-output', style={'overflow-y': 'scroll', 'height': 'calc(100% - 25px)'}),
-            ], className='create_container2 three columns', style={'height': '300px'}),
+                html.Div([
+                    html.P(children="Edge information", className="menu-title"),
+                    dcc.Markdown(id='tap-edge-json-output')
+                ], className='create_container2 three columns', style={'height': '300px'})
+            ], className='row flex-display'),
 
-            html.Div([
-                html.P(children="Edge information", className="menu-title"),
-                dcc.Markdown(id='tap-edge-json-output')
-            ], className='create_container2 three columns', style={'height': '300px'})
-        ], className='row flex-display'),
-
-        dcc.Loading(
-            cyto.Cytoscape(
-                id='cytoscape',
-                style={
-                    'height': '95vh',
-                    'width': '100%'
-                },
-                layout={
-                    'name': 'breadthfirst'
-                }
-            ), type='dot'),
-    ])
+            dcc.Loading(
+                cyto.Cytoscape(
+                    id='cytoscape',
+                    style={
+                        'height': '95vh',
+                        'width': '100%'
+                    },
+                    layout={
+                        'name': 'breadthfirst'
+                    }
+                ), type='dot'),
+        ])
 
-), id="mainContainer", style={"display": "flex", "flex-direction": "column"})
+    ), id="mainContainer", style={"display": "flex", "flex-direction": "column"})
+
+
+app.layout = serve_layout
 
 
 # ############################################# CALLBACKS ###########################################################
@@ -364,84 +457,35 @@ app.layout = html.Div((
 
 # LIVE GRAPH : the graph data are unchangeable, and they are displayed one by one in real time (every 500ms), and the
 # launching of the data can be restarted with the "Restart" button. The type of graph changes according to the selected
-# value of RadioItems (bar or line).
+# value of RadioItems (bar or line). Only the new point is sent to the page at each interval (extendData), the whole
+# figure is sent when the type of graph changes or when the data restarts. The data is read from the live_graph_data
+# store of the page, it is not queried again at each interval.
 @app.callback(
     Output('live_graph', 'figure'),
-    Output('restart_button', 'n_clicks'),
+    Output('live_graph', 'extendData'),
+    Output('live_graph_position', 'data'),
     [
         Input('menu_radioItems', 'value'),
         Input('interval', 'n_intervals'),
         Input('restart_button', 'n_clicks'),
-    ]
+    ],
+    [State('live_graph_position', 'data'), State('live_graph_data', 'data')]
 )
-@static_vars(counter=0)  # initialize the static variable "counter" to 0
-def my_callback(graph_type, n_intervals, n_clicks):
-    # add the first value of index 0 to the graph database then increment counter
-    update_database(my_callback.counter)
-    my_callback.counter += 1
-
-    figure = {
-        'data': []
-    }
-
-    # By clicking the Restart button or by reaching the end of the original database, the graph database becomes empty
-    # and the counter is set to 0
-    if len(live_graph_data) == my_callback.counter or n_clicks:
-        my_callback.counter = 0
-        database['date'] = []
-        database['nb'] = []
+def my_callback(graph_type, n_intervals, n_clicks, position, data):
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    position = position or 0
 
-    # Each time data is added, the data part of the graph is created according to the requested type
-    if graph_type == 'Bar':
-        for x in ['nb']:
-            figure['data'].append(
-                go.Bar(
-                    y=database[x][-40:],
-                    x=database['date'][-40:],
-                    marker=dict(color='#09142F'),
-                    hoverinfo='text',
-                ),
-            )
-    else:
-        for x in ['nb']:
-            figure['data'].append(
-                go.Scatter(
-                    y=database[x][-40:],
-                    x=database['date'][-40:],
-                    mode='markers+lines',
-                    line=dict(width=3, color='#09142F'),
-                    marker=dict(size=6, symbol='circle', color='#09142F'),
-                    hoverinfo='text',
-                ),
-            )
+    # By clicking the Restart button or by reaching the end of the original data, the graph becomes empty
+    if 'restart_button.n_clicks' in triggered or position >= len(data['date']):
+        return live_graph_figure(graph_type, 0, data), dash.no_update, 0
 
-    # The y-axis is set to the maximum value of the data field passed to it or to 200 if this is greater
-    if len(database['nb']) == 0:
-        maximum = 0
-    else:
-        maximum = max(database['nb'])
+    # The type of graph changes: the displayed points are drawn again
+    if 'interval.n_intervals' not in triggered:
+        return live_graph_figure(graph_type, position, data), dash.no_update, position
 
-    # Layout part of the graph
-    figure['layout'] = go.Layout(
-        margin=dict(t=30, r=40, l=50, b=50),
-
-        xaxis=dict(showline=False,
-                   showgrid=False,
-                   showticklabels=True,
-                   linecolor='#808283',
-                   tickfont=dict(size=11, color='#808283')
-                   ),
-
-        yaxis=dict(range=[0, max(200, maximum)],
-                   color='#808283',
-                   showline=False,
-                   showgrid=True,
-                   showticklabels=True,
-                   linecolor='#808283',
-                   tickfont=dict(size=11, color='#808283')
-                   ),
-    )
-    return figure, 0
+    # Add the point of the position to the graph, the browser keeps the last LIVE_GRAPH_MAX_POINTS points
+    point = dict(x=[[data['date'][position]]], y=[[data['nb'][position]]])
+    return dash.no_update, [point, [0], LIVE_GRAPH_MAX_POINTS], position + 1
 
 
 # NB ARTICLES : this callback returns the number of articles published between the 2 dates of datePickerRange
@@ -569,64 +613,28 @@ def update_graph(interval, start_date, end_date):
 
 # DATA TABLE: depends on the two dates of datePickerRange and the search term, and it returns in 4 columns (date of
 # publication, time of publication, title of the article, and its link) a table that groups the articles published
-# between the 2 dates and containing the searched term in their title.
+# between the 2 dates and containing the searched term in their title. The table is paged and sorted by the server:
+# only the requested page is fetched from Elasticsearch (with a point in time and search_after).
 @app.callback(
     Output('datatable', 'data'),
+    Output('datatable', 'page_count'),
+    Output('datatable', 'page_current'),
     Input('date-range', 'start_date'),
     Input('date-range', 'end_date'),
     Input('submit-val', 'n_clicks'),
+    Input('datatable', 'page_current'),
+    Input('datatable', 'sort_by'),
     State('filter', 'value')
 )
-def display_table(start_date, end_date, n_clicks, word):
-    # if no words are entered, all articles published during the requested period are returned.
-    if word == "":
-        body = {
-            "query": {
-                "bool": {
-                    "must": {
-                        "range": {"published": {"gte": start_date, "lte": end_date}}
-                    }
-                }
-            },
-            "sort": [
-                {
-                    "published": {
-                        "order": "asc"
-                    }
-                }
-            ],
-            "_source": ["title", "published", "link"]
-        }
-    else:
-        body = {"query": {
-            "bool": {
-                "must": [
-                    {
-                        "range": {"published": {"gte": start_date, "lte": end_date}}
-                    }, {
-                        "multi_match": {
-                            "query": word,
-                            "fields": [
-                                "title"
-                            ]
-                        }
-                    }
-                ]
-            }
-        },
-            "sort": [
-                {
-                    "published": {
-                        "order": "asc"
-                    }
-                }
-            ],
-            "_source": ["title", "published", "link"]
-        }
+def display_table(start_date, end_date, n_clicks, page_current, sort_by, word):
+    # a new search (or a new sort) starts at the first page
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    if 'datatable.page_current' not in triggered or page_current is None:
+        page_current = 0
 
-    # Then get data from Elasticsearch
-    df = pd.DataFrame(iterate_whole_es(index_name, 10000, data_table, body))
-    return df.to_dict('records')
+    # if no words are entered, all articles published during the requested period are returned.
+    rows, total = table_page(index_name, table_query(start_date, end_date, word), table_sort(sort_by), page_current)
+    return rows, max(1, math.ceil(total / TABLE_PAGE_SIZE)), page_current
 
 
 # PIE CHART : depends only on the two dates of datePickerRange, and it returns a pie chart that represents the
@@ -672,22 +680,34 @@ def update_graph(start_date, end_date):
 # the articles published between the 2 dates.
 @app.callback(Output("map_chart", "figure"),
               [Input('date-range', 'start_date')],
-              [Input('date-range', 'end_date')])
-def update_graph(start_date, end_date):
-    # Get data from Elasticsearch and return the figure of the graph composed by data and layout
-    body = {"query": {
-        "bool": {
-            "must": [{"range": {
-                "published": {
-                    "gte": start_date,
-                    "lte": end_date
-                }}
-            }]
-        }
-    },
-        "_source": ["ner_loca_title"]}
+              [Input('date-range', 'end_date')],
+              [State('session-id', 'data')])
+def update_graph(start_date, end_date, session_id):
+    # The scroll of a previous query of the page is stopped
+    is_cancelled = latest_requests.start((session_id, "map_chart"))
+
+    # Get data from Elasticsearch and return the figure of the graph composed by data and layout: the locations are
+    # counted by Elasticsearch in the side index of the locations, or in Python if this index is not created yet
+    if exists_index(index_name + "_locations"):
+        data = top_locations(start_date, end_date, index_name)
+    else:
+        body = {"query": {
+            "bool": {
+                "must": [{"range": {
+                    "published": {
+                        "gte": start_date,
+                        "lte": end_date
+                    }}
+                }]
+            }
+        },
+            "_source": ["ner_loca_title"]}
 
-    data = locations_processing(iterate_whole_es(index_name, 10000, data_for_map_chart, body))
+        try:
+            data = run_unless_cancelled(is_cancelled, reduced_scroll, index_name, 10000, data_for_map_chart,
+                                        locations_processing, body)
+        except QueryCancelled:
+            raise PreventUpdate
     fig = px.scatter_geo(data,
                          hover_name="Location",
                          size=data["Frequency"] * 10,
@@ -791,6 +811,8 @@ def update_slider(start_date, end_date, children):
                            step=steps,
                            pushable=1,
                            allowCross=False,
+                           # the bubble chart is updated when the handle is released, not during the drag
+                           updatemode='mouseup',
                            value=[T - (steps + T % steps), T],
                            # value=[0, steps],
                            marks=marks)
@@ -801,33 +823,45 @@ def update_slider(start_date, end_date, children):
 @app.callback(Output("bubble_chart", "figure"),
               [Input({"type": "range_slider", "index": ALL}, 'value')],
               [Input('date-range', 'start_date')],
-              [Input('date-range', 'end_date')])
-def update_graph(dates, start_date, end_date):
+              [Input('date-range', 'end_date')],
+              [State('session-id', 'data')])
+def update_graph(dates, start_date, end_date, session_id):
     start_date = pd.to_datetime(start_date).date()
     end_date = pd.to_datetime(end_date).date()
     date_list = pd.date_range(start=start_date, end=end_date)
 
-    # If no period is selected in rangeSlider, wait for the next choice
-    while len(dates) == 0:
-        continue
+    # If no period is selected in rangeSlider (not rendered yet), wait for the next choice
+    if len(dates) == 0:
+        raise PreventUpdate
+
+    # The scroll of a previous query of the page (previous position of the rangeSlider) is stopped
+    is_cancelled = latest_requests.start((session_id, "bubble_chart"))
 
     # return the real dates selected, since the two values returned by rangeSlider are the scale number and not its
     # label content
     dates = [date_list[dates[0][0]], date_list[dates[0][1]]]
 
-    # Get data from Elasticsearch and return the figure of the graph composed by data and layout
-    body = {"query": {
-        "bool": {
-            "must":
-                {
-                    "range": {"published": {"gte": dates[0], "lte": dates[1] + timedelta(days=1)}}
-                }
+    # Get data from Elasticsearch and return the figure of the graph composed by data and layout: the words are read from
+    # the side index of the daily tokens, or counted in Python from the POS tagging if this index is not created yet
+    if exists_index(index_name + "_daily_tokens"):
+        df = top_daily_tokens(dates[0], dates[1], index_name)
+    else:
+        body = {"query": {
+            "bool": {
+                "must":
+                    {
+                        "range": {"published": {"gte": dates[0], "lte": dates[1] + timedelta(days=1)}}
+                    }
+            }
+        },
+            "_source": ["published", "pos_tag_title", "pos_tag_message"]
         }
-    },
-        "_source": ["published", "pos_tag_title", "pos_tag_message"]
-    }
 
-    df = tokens_size(pd.DataFrame(iterate_whole_es(index_name, 10000, data_for_bubble_chart, body)))
+        try:
+            df = run_unless_cancelled(is_cancelled, reduced_scroll, index_name, 10000, data_for_bubble_chart,
+                                      tokens_size, body)
+        except QueryCancelled:
+            raise PreventUpdate
 
     return {'data': [go.Scatter(
         x=df['date'],
@@ -882,13 +916,16 @@ def update_graph(dates, start_date, end_date):
 # place), and it returns a network graph
 @app.callback(Output('cytoscape', 'elements'),
               [Input('date-picker-single', 'date')],
-              [Input('dropdown-update-elements', 'value')])
-def display_data(date_value, dropdown_value):
+              [Input('dropdown-update-elements', 'value')],
+              [Input('cooccurrence-mode', 'value')])
+def display_data(date_value, dropdown_value, cooccurrence):
     # if a date is selected, it returns the NERs previously saved in a csv file that match the inputs data
     if date_value is not None:
         date_value = pd.Timestamp(date_value)
-        elements = cytoscape_data(str(date_value), str(date_value + timedelta(days=1)), "csv_files/NERs.csv",
-                                  "csv_files/links.csv", dropdown_value)
+        # the Parquet dataset of the NERs is used when main.py has created it
+        ners_file = "csv_files/NERs_parquet" if os.path.isdir("csv_files/NERs_parquet") else "csv_files/NERs.csv"
+        elements = cytoscape_data(str(date_value), str(date_value + timedelta(days=1)), ners_file,
+                                  "csv_files/links.csv", dropdown_value, cooccurrence)
         return elements
 
 
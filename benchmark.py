@@ -0,0 +1,197 @@
+"""
+    Micro-benchmarks of the data processing functions of functions.py, they run on generated data and do not need
+    Elasticsearch: python benchmark.py
+"""
+import random
+import time
+from collections import Counter
+
+import pandas as pd
+
+from functions import locations_processing, data_table, data_for_bubble_chart, tokens_size, bubble_sizes
+
+
+def locations_processing_quadratic(data):
+    """
+        Previous implementation of locations_processing (list search and count for each mention), kept as reference
+        :param data: list of location mentions
+    """
+    loc = []
+    freq = []
+    lat = []
+    lon = []
+
+    for i in range(len(data)):
+        if data[i] not in data[i + 1:] and len(data[i]) == 3:
+            longitude = data[i]["longitude"]
+            latitude = data[i]["latitude"]
+            if (latitude is not None) and (longitude is not None):
+                if (latitude != -1) and (longitude != -1):
+                    loc.append(data[i]["loc"])
+                    freq.append(data.count(data[i]))
+                    lat.append(latitude)
+                    lon.append(longitude)
+    return pd.DataFrame({'Location': loc, 'Frequency': freq, 'Latitude': lat, 'Longitude': lon})
+
+
+def location_mentions(nb_mentions, nb_locations=500):
+    """
+        Function to generate location mentions as they are saved in the ner_loca_title field
+        :param nb_mentions: number of mentions
+        :param nb_locations: number of distinct locations
+    """
+    locations = [{'loc': "Location " + str(i), "latitude": random.uniform(-90, 90),
+                  "longitude": random.uniform(-180, 180)} for i in range(nb_locations)]
+    # some locations are not found by the geocoder
+    locations += [{'loc': "Unknown " + str(i), "latitude": -1, "longitude": -1} for i in range(nb_locations // 10)]
+    return [dict(random.choice(locations)) for _ in range(nb_mentions)]
+
+
+def data_table_per_row(data, previous_result):
+    """
+        Previous implementation of data_table (two conversions of the date for each article), kept as reference
+        :param data: Elasticsearch result received from iterate_whole_es
+        :param previous_result: data of the previous iteration of iterate_whole_es
+    """
+    if not previous_result:
+        previous_result = []
+
+    for element in data:
+        title = element['_source']['title_clean'].replace("-", " ")
+        date = pd.to_datetime(element["_source"]["published"], format='%Y-%m-%dT%H:%M:%S.%fZ').date()
+        time = pd.to_datetime(element["_source"]["published"], format='%Y-%m-%dT%H:%M:%S.%fZ').time()
+
+        previous_result.append({"Title": title,
+                                "Date": date,
+                                "Time": time,
+                                "Link": element["_source"]["link"]})
+    return previous_result
+
+
+def articles(nb_articles):
+    """
+        Function to generate articles as they are returned by Elasticsearch for the data table
+        :param nb_articles: number of articles
+    """
+    start = pd.Timestamp("2022-01-01")
+    return [{"_source": {"title_clean": "Title of the article " + str(i),
+                         "published": (start + pd.Timedelta(seconds=random.randrange(3600 * 24 * 365)))
+                         .strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + "Z",
+                         "link": "https://example.com/" + str(i)}} for i in range(nb_articles)]
+
+
+def bubble_chart_lists(chunks):
+    """
+        Previous implementation of the bubble chart pipeline (a list of words per article, concatenated per day by a
+        groupby), kept as reference
+        :param chunks: chunks of Elasticsearch results
+    """
+    rows = []
+    for data in chunks:
+        for element in data:
+            date = pd.to_datetime(element['_source']['published'], format='%Y-%m-%dT%H:%M:%S.%fZ').date()
+            list_tokens = [pos['token'] for field in ['pos_tag_title', 'pos_tag_message']
+                           for pos in element['_source'][field]
+                           if pos['pos_tag'] in ['ADJ', 'ADV', 'NOUN', 'NUM', 'PROPN', 'SYM', 'VERB']]
+            rows.append({'date': date, 'tokens': list_tokens})
+
+    df = pd.DataFrame(rows).groupby(['date'])['tokens'].sum().reset_index()
+    return bubble_sizes((df['date'][x], Counter(df['tokens'][x]).most_common(15)) for x in range(len(df)))
+
+
+def bubble_chart_counters(chunks):
+    """
+        Function to run the bubble chart pipeline of the dashboard (a Counter per day filled chunk by chunk)
+        :param chunks: chunks of Elasticsearch results
+    """
+    result = None
+    for data in chunks:
+        result = data_for_bubble_chart(data, result)
+    return tokens_size(result)
+
+
+def tagged_articles(nb_articles, nb_days=5, vocabulary=5000):
+    """
+        Function to generate articles with the POS tagging of their title and message, as they are returned by
+        Elasticsearch for the bubble chart
+        :param nb_articles: number of articles
+        :param nb_days: number of days of the articles
+        :param vocabulary: number of distinct words
+    """
+    tags = ['ADJ', 'ADV', 'NOUN', 'NUM', 'PROPN', 'SYM', 'VERB', 'DET', 'ADP', 'PUNCT']
+    # the frequencies of the words follow a Zipf law, as in the articles
+    words = ["word" + str(i) for i in range(vocabulary)]
+    weights = [1 / (i + 1) for i in range(vocabulary)]
+
+    def pos_tags(nb_tokens):
+        return [{"token": token, "pos_tag": random.choice(tags)}
+                for token in random.choices(words, weights, k=nb_tokens)]
+
+    return [{"_source": {"published": "2022-01-%02dT10:00:00.000Z" % random.randint(1, nb_days),
+                         "pos_tag_title": pos_tags(10), "pos_tag_message": pos_tags(150)}}
+            for _ in range(nb_articles)]
+
+
+def timed(function, *args):
+    """
+        Function to measure the execution time of a function
+        :param function: function to call
+        :param args: arguments of the function
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def benchmark_locations_processing(sizes=(1000, 2000, 4000, 8000, 16000)):
+    """
+        Function to compare the execution time of the two implementations of locations_processing according to the
+        number of mentions
+        :param sizes: numbers of mentions
+    """
+    print(">> locations_processing : mentions | quadratic (s) | groupby (s)")
+    for size in sizes:
+        data = location_mentions(size)
+        quadratic_time, expected = timed(locations_processing_quadratic, data)
+        groupby_time, result = timed(locations_processing, data)
+        assert expected.equals(result.astype(expected.dtypes))
+        print("{:>10} | {:>13.4f} | {:>11.4f}".format(size, quadratic_time, groupby_time))
+
+
+def benchmark_data_table(sizes=(1000, 10000, 50000)):
+    """
+        Function to compare the execution time per article of the two implementations of data_table according to the
+        number of articles (in a single chunk)
+        :param sizes: numbers of articles
+    """
+    print(">> data_table : articles | per row (us/article) | vectorized (us/article)")
+    for size in sizes:
+        data = articles(size)
+        per_row_time, expected = timed(data_table_per_row, data, None)
+        vectorized_time, result = timed(data_table, data, None)
+        assert expected == result
+        print("{:>10} | {:>20.2f} | {:>23.2f}".format(size, per_row_time / size * 1e6, vectorized_time / size * 1e6))
+
+
+def benchmark_bubble_chart(sizes=(1000, 2000, 4000, 8000), chunk_size=1000):
+    """
+        Function to compare the execution time of the two implementations of the bubble chart pipeline according to the
+        number of articles
+        :param sizes: numbers of articles
+        :param chunk_size: number of articles of a chunk of iterate_whole_es
+    """
+    print(">> bubble chart : articles | lists + groupby (s) | Counter per day (s)")
+    for size in sizes:
+        data = tagged_articles(size)
+        chunks = [data[i:i + chunk_size] for i in range(0, size, chunk_size)]
+        lists_time, expected = timed(bubble_chart_lists, chunks)
+        counters_time, result = timed(bubble_chart_counters, chunks)
+        assert expected.equals(result)
+        print("{:>10} | {:>20.4f} | {:>19.4f}".format(size, lists_time, counters_time))
+
+
+if __name__ == '__main__':
+    random.seed(0)
+    benchmark_locations_processing()
+    benchmark_data_table()
+    benchmark_bubble_chart()
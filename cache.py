@@ -0,0 +1,464 @@
+"""
+    Persistent caches stored in SQLite files, they keep the results of the slow network lookups (geocoding of the
+    locations, wikipedia pages of the organizations) between two runs of main.py, and the unknown names are resolved
+    concurrently with a limited rate of requests.
+    The QueryCache keeps the results of the Elasticsearch queries of the dashboard.
+"""
+import functools
+import hashlib
+import inspect
+import json
+import math
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
+
+# Folder of the cache files
+CACHE_FOLDER = "cache_files"
+
+# Maximum number of keys in a single SQLite query
+SQLITE_MAX_KEYS = 500
+
+# Number of values saved in the shared SQLite cache of the queries between two removals of the expired values
+SQLITE_PURGE_EVERY = 100
+
+
+def open_cache(file_name, table):
+    """
+        Function to open a SQLite cache file and create its key/value table if it does not exist
+        :param file_name: name of the SQLite file
+        :param table: name of the table
+    """
+    folder = os.path.dirname(file_name)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+    conn = sqlite3.connect(file_name, timeout=30)
+    conn.execute("CREATE TABLE IF NOT EXISTS " + table + " (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+    return conn
+
+
+def cache_get_many(conn, table, keys):
+    """
+        Function to get the values of several keys, the expired entries are ignored
+        :param conn: connection returned by open_cache
+        :param table: name of the table
+        :param keys: list of keys
+    """
+    keys = list(keys)
+    now = time.time()
+    values = {}
+    for i in range(0, len(keys), SQLITE_MAX_KEYS):
+        part = keys[i:i + SQLITE_MAX_KEYS]
+        rows = conn.execute("SELECT key, value FROM " + table + " WHERE key IN (" + ",".join("?" * len(part)) +
+                            ") AND (expires IS NULL OR expires > ?)", part + [now])
+        for key, value in rows:
+            values[key] = json.loads(value)
+    return values
+
+
+def cache_set_many(conn, table, items, ttl=None):
+    """
+        Function to save several key/value pairs in the cache
+        :param conn: connection returned by open_cache
+        :param table: name of the table
+        :param items: dict of the values to save
+        :param ttl: lifetime of the entries in seconds (None for no expiration)
+    """
+    expires = None if ttl is None else time.time() + ttl
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO " + table + " (key, value, expires) VALUES (?, ?, ?)",
+                         [(key, json.dumps(value), expires) for key, value in items.items()])
+
+
+class TokenBucket:
+    """
+        Rate limiter shared by the threads sending requests to the same backend: a request takes a token, and the
+        tokens are refilled at a constant rate up to the capacity of the bucket
+    """
+
+    def __init__(self, rate, capacity=1):
+        """
+            :param rate: number of tokens added per second
+            :param capacity: maximum number of tokens, that is the size of a burst of requests
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+            Function to take a token, waiting until one is available
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class TransientLookupError(Exception):
+    """
+        Exception raised by cached_lookup when some names could not be resolved because of a transient error of the
+        backend (timeout, network error ...): the other names are cached before, and the failed names are not cached so
+        that the next call tries them again
+    """
+
+
+def lookup_concurrently(names, lookup_function, max_workers=1, rate_limiter=None, transient_errors=()):
+    """
+        Function to call lookup_function for each name with a pool of threads
+        :param names: list of names
+        :param lookup_function: function called with a name
+        :param max_workers: maximum number of concurrent calls
+        :param rate_limiter: TokenBucket limiting the rate of the calls (None for no limit)
+        :param transient_errors: exception classes of lookup_function caught for each name (the other exceptions are
+        raised)
+        -> returns the list of the (True, result) or (False, exception) pairs, in the order of names
+    """
+    def limited_lookup(name):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return True, lookup_function(name)
+        except transient_errors as e:
+            return False, e
+
+    if max_workers <= 1 or len(names) <= 1:
+        return [limited_lookup(name) for name in names]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(names))) as executor:
+        return list(executor.map(limited_lookup, names))
+
+
+def cached_lookup(names, lookup_function, file_name, table, normalize, ttl=None, miss_ttl=None, is_miss=None,
+                  max_workers=1, rate_limiter=None, transient_errors=()):
+    """
+        Function to resolve a set of names with a persistent cache: the distinct names are searched in the cache first,
+        and only the unknown names are sent to lookup_function
+        :param names: list of names to resolve (they can be repeated)
+        :param lookup_function: function called with a name, it returns a value to cache, or None if nothing is found
+        :param file_name: name of the SQLite file
+        :param table: name of the table
+        :param normalize: function returning the cache key of a name
+        :param ttl: lifetime in seconds of the found values (None for no expiration)
+        :param miss_ttl: lifetime in seconds of the names not found (None for no expiration)
+        :param is_miss: function telling if a value returned by lookup_function is a miss (value is None by default)
+        :param max_workers: maximum number of concurrent calls of lookup_function
+        :param rate_limiter: TokenBucket limiting the rate of the calls of lookup_function (None for no limit)
+        :param transient_errors: exception classes of lookup_function that are not a result (timeout, network error
+        ...), the names failing with them are not cached and TransientLookupError is raised after the other names
+        are cached
+        -> returns a dict {key: value}, the value is None for the names not found
+    """
+    if is_miss is None:
+        is_miss = lambda value: value is None
+
+    # Keep the first spelling of each name to send it to lookup_function
+    distinct = {}
+    for name in names:
+        distinct.setdefault(normalize(name), name)
+
+    with closing(open_cache(file_name, table)) as conn:
+        values = cache_get_many(conn, table, distinct)
+        unknown = [key for key in distinct if key not in values]
+        results = lookup_concurrently([distinct[key] for key in unknown], lookup_function, max_workers, rate_limiter,
+                                      transient_errors)
+
+        found = {}
+        missed = {}
+        failed = {}
+        for key, (ok, value) in zip(unknown, results):
+            if not ok:
+                failed[key] = value
+            elif is_miss(value):
+                missed[key] = value
+            else:
+                found[key] = value
+
+        cache_set_many(conn, table, found, ttl)
+        cache_set_many(conn, table, missed, miss_ttl)
+
+    if failed:
+        key, error = next(iter(failed.items()))
+        raise TransientLookupError(str(len(failed)) + " name(s) not resolved in " + table + ", first error on \"" +
+                                   distinct[key] + "\" : " + repr(error))
+
+    values.update(found)
+    values.update(missed)
+    return values
+
+
+class SqliteBackend:
+    """
+        Shared backend of a QueryCache stored in a SQLite file, it can be shared by the workers of the server running on
+        the same machine
+    """
+
+    def __init__(self, file_name, table="query_cache", purge_every=SQLITE_PURGE_EVERY):
+        """
+            :param file_name: name of the SQLite file
+            :param table: name of the table
+            :param purge_every: number of saved values between two removals of the expired values
+        """
+        self.file_name = file_name
+        self.table = table
+        self.purge_every = purge_every
+        self.nb_sets = 0
+        self.lock = threading.Lock()
+        with closing(open_cache(file_name, table)) as conn, conn:
+            self.purge(conn)
+
+    def purge(self, conn):
+        """
+            Function to remove the expired values, so that the file does not grow with each new query
+            :param conn: connection to the SQLite file
+        """
+        conn.execute("DELETE FROM " + self.table + " WHERE expires < ?", (time.time(),))
+
+    def get(self, key):
+        """
+            Function to get the serialized value of a key, or None if it is missing or expired
+            :param key: key of the value
+        """
+        with closing(sqlite3.connect(self.file_name, timeout=30)) as conn:
+            row = conn.execute("SELECT value FROM " + self.table + " WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                               (key, time.time())).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key, value, ttl):
+        """
+            Function to save the serialized value of a key
+            :param key: key of the value
+            :param value: serialized value (bytes)
+            :param ttl: lifetime of the value in seconds
+        """
+        with self.lock:
+            self.nb_sets += 1
+            purge = self.nb_sets % self.purge_every == 0
+        with closing(sqlite3.connect(self.file_name, timeout=30)) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO " + self.table + " (key, value, expires) VALUES (?, ?, ?)",
+                         (key, sqlite3.Binary(value), time.time() + ttl))
+            if purge:
+                self.purge(conn)
+
+
+class RedisBackend:
+    """
+        Shared backend of a QueryCache stored in Redis, client is any Redis-compatible client (get and setex methods)
+    """
+
+    def __init__(self, client, prefix="query_cache:"):
+        """
+            :param client: Redis client, for example redis.Redis(host="localhost")
+            :param prefix: prefix of the keys
+        """
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        """
+            Function to get the serialized value of a key, or None if it is missing or expired
+            :param key: key of the value
+        """
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        """
+            Function to save the serialized value of a key
+            :param key: key of the value
+            :param value: serialized value (bytes)
+            :param ttl: lifetime of the value in seconds
+        """
+        self.client.setex(self.prefix + key, int(math.ceil(ttl)), value)
+
+
+class SingleFlight:
+    """
+        Deduplication of the concurrent identical calls: the first call of a key runs the function, and the calls of
+        the same key made before its end wait for its result instead of running the function again
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, function, *args, **kwargs):
+        """
+            Function to run function(*args, **kwargs), or to wait for the result of the running call of the same key
+            :param key: key of the call
+            :param function: function to call
+        """
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = function(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+
+class QueryCache:
+    """
+        Cache of the results of the queries: a LRU cache in memory with a maximum number of entries and a lifetime,
+        backed by an optional shared backend (SqliteBackend or RedisBackend) so that the workers share their results
+    """
+
+    def __init__(self, maxsize=256, ttl=600, backend=None):
+        """
+            :param maxsize: maximum number of entries kept in memory
+            :param ttl: lifetime of the entries in seconds
+            :param backend: shared backend (None to keep the entries only in memory)
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "backend_hits": 0, "misses": 0}
+        self.flights = SingleFlight()
+
+    def get(self, key):
+        """
+            Function to get the value of a key
+            :param key: key of the value
+            -> returns (True, value) if the key is cached, (False, None) otherwise
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return True, entry[1]
+            self.entries.pop(key, None)
+
+        if self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                value = pickle.loads(value)
+                self.store(key, value)
+                with self.lock:
+                    self.counters["backend_hits"] += 1
+                return True, value
+
+        with self.lock:
+            self.counters["misses"] += 1
+        return False, None
+
+    def store(self, key, value):
+        """
+            Function to save a value in memory, the least recently used entries are removed beyond maxsize
+            :param key: key of the value
+            :param value: value to save
+        """
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def set(self, key, value):
+        """
+            Function to save a value in memory and in the shared backend
+            :param key: key of the value
+            :param value: value to save
+        """
+        self.store(key, value)
+        if self.backend is not None:
+            self.backend.set(key, pickle.dumps(value), self.ttl)
+
+    def clear(self):
+        """
+            Function to remove the entries kept in memory
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+            Function to get the hit/miss counters, the number of calls coalesced with a running identical call, and the
+            number of entries kept in memory
+        """
+        with self.lock:
+            return dict(self.counters, coalesced=self.flights.coalesced, size=len(self.entries))
+
+
+def query_key(function, args, kwargs, signature=None):
+    """
+        Function to get the cache key of a call: the arguments are bound to the parameters of the function (with their
+        default values), so that f(a, b), f(a, b=b) and f(a, b, c=default) get the same key, and they are normalized in
+        a JSON string (the functions are replaced by their names, the dates by their strings), so that the key is the
+        same in all the workers
+        :param function: called function
+        :param args: positional arguments
+        :param kwargs: keyword arguments
+        :param signature: signature of the function (computed if it is not given)
+    """
+    def normalize(value):
+        if callable(value):
+            return value.__module__ + "." + value.__qualname__
+        return str(value)
+
+    if signature is None:
+        signature = inspect.signature(function)
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    return hashlib.sha1(json.dumps([function.__module__ + "." + function.__qualname__, bound.arguments],
+                                   sort_keys=True, default=normalize).encode("utf8")).hexdigest()
+
+
+def cached_query(query_cache):
+    """
+        Decorator caching the results of a function in query_cache, according to its arguments, the concurrent calls
+        with the same arguments are coalesced into a single call
+        :param query_cache: QueryCache
+    """
+    def decorate(function):
+        signature = inspect.signature(function)
+
+        def compute(key, args, kwargs):
+            value = function(*args, **kwargs)
+            query_cache.set(key, value)
+            return value
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = query_key(function, args, kwargs, signature)
+            found, value = query_cache.get(key)
+            if not found:
+                # the concurrent identical calls share the same query
+                value = query_cache.flights.do(key, compute, key, args, kwargs)
+            return value
+
+        return wrapper
+
+    return decorate
@@ -1,19 +1,62 @@
+import ast
 import csv
+import functools
+import hashlib
 import io
 import json
+import multiprocessing
 import os
+import queue
+import shutil
+import time
+from collections import Counter
 
 import html2text
 import pandas as pd
+import requests
 import spacy
 import wikipedia
 from elasticsearch import Elasticsearch, helpers, exceptions
+from geopy.exc import GeocoderTimedOut, GeocoderUnavailable, GeocoderQuotaExceeded
 from geopy.geocoders import Nominatim
 
+from cache import CACHE_FOLDER, TokenBucket, TransientLookupError, cached_lookup
+
 # pip install --default-timeout=100 future
 # Locate a place and determine its latitude and longitude
 geolocator = Nominatim(user_agent="MyApp", timeout=10)
 
+# Rate limiters of the network backends, Nominatim usage policy allows at most 1 request per second
+geocode_rate_limiter = TokenBucket(rate=1)
+wiki_rate_limiter = TokenBucket(rate=10, capacity=10)
+
+# Number of concurrent requests sent to the geocoder and to wikipedia
+GEOCODE_MAX_WORKERS = 2
+WIKI_MAX_WORKERS = 8
+
+# Persistent cache of the coordinates of the locations, the locations not found are cached for a shorter time
+GEOCODE_CACHE_FILE = os.path.join(CACHE_FOLDER, "geocode.sqlite")
+GEOCODE_CACHE_TTL = 180 * 24 * 3600
+GEOCODE_MISS_TTL = 30 * 24 * 3600
+
+# Errors of the geocoder that are not a result: these locations are not cached and they are searched again at the next
+# run (a missing location is a None result, not an error)
+GEOCODE_TRANSIENT_ERRORS = (GeocoderTimedOut, GeocoderUnavailable, GeocoderQuotaExceeded)
+
+# Persistent cache of the wikipedia definitions and links of the organizations, the organizations without a page or
+# with an ambiguous name are cached for a shorter time
+WIKI_CACHE_FILE = os.path.join(CACHE_FOLDER, "wikipedia.sqlite")
+WIKI_CACHE_TTL = 180 * 24 * 3600
+WIKI_MISS_TTL = 30 * 24 * 3600
+
+# Errors of the wikipedia API that are not a result (network errors, timeouts): these organizations are not cached and
+# they are searched again at the next run
+WIKI_TRANSIENT_ERRORS = (requests.exceptions.RequestException, wikipedia.exceptions.HTTPTimeoutError)
+
+# File of the checkpoints of the stages of main.py, and sort used to resume a stage after its last processed document
+CHECKPOINT_FILE = os.path.join(CACHE_FOLDER, "checkpoints.json")
+STAGE_SORT = [{"published": "asc"}, {"_id": "asc"}]
+
 # Initialize the SpaCy library with the French language
 nlp = spacy.load('fr_core_news_lg')
 
@@ -22,7 +65,103 @@ h = html2text.HTML2Text()
 h.ignore_links = True
 
 # Create instance of Elasticsearch
-es = Elasticsearch("http://localhost:9200")
+ES_HOST = "http://localhost:9200"
+es = Elasticsearch(ES_HOST)
+
+# Number of texts buffered by nlp.pipe, and number of processes used to run the SpaCy pipeline
+PIPE_BATCH_SIZE = 128
+PIPE_N_PROCESS = 1
+
+# Components of the SpaCy pipeline that are not needed by the enrichers, they are disabled when the texts are processed
+POS_DISABLED_PIPES = ["parser", "lemmatizer", "ner"]
+NER_DISABLED_PIPES = ["morphologizer", "parser", "attribute_ruler", "lemmatizer"]
+
+# Number of actions sent in a single bulk request, and number of retries of a bulk request rejected by Elasticsearch
+# because its queue is full (HTTP 429)
+BULK_CHUNK_SIZE = 500
+BULK_MAX_RETRIES = 5
+
+# Number of failed actions printed at the end of a bulk load
+BULK_MAX_REPORTED_ERRORS = 10
+
+# Fields whose cleaned text (without HTML tags and repeated spaces) is saved in a "<field>_clean" field
+CLEAN_FIELDS = ["title", "message"]
+
+# Explicit mapping of the index of the articles: the large arrays of the enrichment only read from _source (tokens of
+# the POS Tagging, wikipedia definitions) are neither indexed nor stored in doc values, the small tags stay indexed
+# so that the "exists" queries of main.py can still find the processed documents
+NOT_INDEXED_KEYWORD = {"type": "keyword", "index": False, "doc_values": False}
+INDEX_MAPPING = {
+    "properties": {
+        "published": {"type": "date"},
+        # the keyword sub-field keeps the "Feed.keyword" aggregations of the dashboard working
+        "Feed": {"type": "keyword", "fields": {"keyword": {"type": "keyword"}}},
+        "title": {"type": "text"},
+        "message": {"type": "text"},
+        "link": {"type": "keyword"},
+        # marker written by annotate_fields, the "exists" query of main.py can not rely on the NER fields since they are
+        # often empty lists
+        "annotated": {"type": "boolean"},
+        # markers written by wiki_field for the same reason (an article without organization has an empty wiki_ field)
+        "wikied_title": {"type": "boolean"},
+        "wikied_message": {"type": "boolean"},
+        **{prefix + field: mapping
+           for field in ["title", "message"]
+           for prefix, mapping in [
+               ("pos_tag_", {"properties": {"token": NOT_INDEXED_KEYWORD, "pos_tag": {"type": "keyword"}}}),
+               ("ner_per_", {"type": "keyword"}),
+               ("ner_org_", {"type": "keyword"}),
+               ("ner_loca_", {"properties": {"loc": {"type": "keyword"}, "latitude": {"type": "float"},
+                                             "longitude": {"type": "float"}}}),
+               ("wiki_", {"properties": {"org": {"type": "keyword"}, "info": {"type": "text", "index": False},
+                                         "link": NOT_INDEXED_KEYWORD}}),
+           ]},
+        # texts without HTML tags and repeated spaces, they are only read (by the dashboard and the SpaCy pipeline), and
+        # the indexed marker of the documents whose texts are cleaned
+        **{field + "_clean": {"type": "text", "index": False} for field in CLEAN_FIELDS},
+        "cleaned": {"type": "boolean"}
+    }
+}
+
+# Mapping of the side index of the locations: one document per geocoded LOC mention, so that the map chart can count the
+# locations with a terms aggregation
+LOCATIONS_MAPPING = {
+    "properties": {
+        "article_id": {"type": "keyword"},
+        "field": {"type": "keyword"},
+        "published": {"type": "date"},
+        "loc": {"type": "keyword"},
+        "location": {"type": "geo_point"}
+    }
+}
+
+# POS tags of the words counted by the bubble chart of the dashboard
+BUBBLE_POS_TAGS = ['ADJ', 'ADV', 'NOUN', 'NUM', 'PROPN', 'SYM', 'VERB']
+
+# Mapping of the side index of the words of the articles: one document per (article, word) with the day of the article
+# and the number of occurrences of the word. The id is built from the id of the article and a hash of the word, so a
+# chunk replayed after a crash or a failed bulk request overwrites its documents instead of counting them twice
+ARTICLE_TOKENS_MAPPING = {
+    "properties": {
+        "article_id": {"type": "keyword"},
+        "day": {"type": "date"},
+        "token": {"type": "keyword"},
+        "count": {"type": "long"}
+    }
+}
+
+# Mapping of the side index of the daily tokens: the DAILY_TOKENS_TOP most frequent words of each day, computed again
+# from the words of the articles for the days of each processed chunk, so that the bubble chart reads DAILY_TOKENS_TOP
+# rows per day. "computed" is the time of the computation, an older computation does not replace a newer one
+DAILY_TOKENS_MAPPING = {
+    "properties": {
+        "day": {"type": "date"},
+        "token": {"type": "keyword"},
+        "count": {"type": "long"},
+        "computed": {"type": "long"}
+    }
+}
+DAILY_TOKENS_TOP = 15
 
 
 def delete_index(index_name):
@@ -33,38 +172,185 @@ def delete_index(index_name):
     print(">> " + index_name + " index deleted : " + str(es.indices.delete(index=index_name)))
 
 
-def json_to_es_with_bulk(file_name):
+def read_json_lines(file_name, dead_letter_file, stats):
     """
-        Function to load an indexed json file in Elasticsearch
-        :param file_name: name of the JSON file to load
+        Generator of the documents of an indexed json file (one JSON document per line), the lines are read lazily and
+        the malformed lines are written to a dead-letter file instead of stopping the load
+        :param file_name: name of the JSON file to read
+        :param dead_letter_file: file receiving the malformed lines
+        :param stats: dict counting the "read" and "malformed" lines
     """
-    # convert text file to list
-    lines_list = [line.strip() for line in open(file_name, encoding="utf8", errors='ignore')]
+    dead_letter = None
+    try:
+        with open(file_name, encoding="utf8", errors='ignore') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                stats["read"] += 1
+                try:
+                    # convert the string to a dict object
+                    yield json.loads(line)
+                except ValueError as e:
+                    stats["malformed"] += 1
+                    print("JSON loads() ERROR : " + str(e))
+                    if dead_letter is None:
+                        dead_letter = open(dead_letter_file, 'a', encoding="utf8")
+                    dead_letter.write(line + '\n')
+    finally:
+        if dead_letter is not None:
+            dead_letter.close()
+
+
+def without_doc_type(docs):
+    """
+        Function to remove the mapping type ("_type" key) of the documents of a dump, the documents are loaded in the
+        typeless index created by create_index
+        :param docs: documents to load
+    """
+    for doc in docs:
+        if isinstance(doc, dict):
+            doc.pop("_type", None)
+        yield doc
 
-    # define an empty list for the Elasticsearch docs
-    doc_list = []
 
-    for doc in lines_list:
-        try:
-            # convert the string to a dict object
-            dict_doc = json.loads(doc)
+def with_clean_fields(docs, fields=None):
+    """
+        Function to add the cleaned texts ("<field>_clean" fields) and the "cleaned" marker to the documents of a bulk
+        load
+        :param docs: documents to load (bulk actions with a "_source" key, or documents)
+        :param fields: fields to clean (CLEAN_FIELDS by default)
+    """
+    if fields is None:
+        fields = CLEAN_FIELDS
+    for doc in docs:
+        source = doc.get("_source", doc)
+        if isinstance(source, dict):
+            source.update(clean_fields_of(source, fields), cleaned=True)
+        yield doc
 
-            # append the dict object to the list []
-            doc_list += [dict_doc]
-        except Exception as e:
-            print("JSON loads() ERROR : " + str(e))
-            quit()
 
+def json_to_es_with_bulk(file_name, chunk_size=BULK_CHUNK_SIZE, thread_count=1, dead_letter_file=None,
+                         index_name=None):
+    """
+        Function to load an indexed json file in Elasticsearch, the file is streamed so the memory used does not depend
+        on its size
+        :param file_name: name of the JSON file to load
+        :param chunk_size: number of documents sent in a single bulk request
+        :param thread_count: number of threads sending the bulk requests (helpers.parallel_bulk is used with more than
+        1 thread, helpers.streaming_bulk otherwise)
+        :param dead_letter_file: file receiving the malformed lines (file_name + ".dead_letter" by default), the
+        documents rejected by Elasticsearch are saved with their errors in file_name + ".failed"
+        :param index_name: index of the documents without an "_index" key (None to use only the "_index" keys)
+    """
+    if dead_letter_file is None:
+        dead_letter_file = file_name + ".dead_letter"
+
+    # default index of the bulk requests
+    kwargs = {} if index_name is None else {"index": index_name}
+
+    stats = {"read": 0, "malformed": 0}
+    docs = with_clean_fields(without_doc_type(read_json_lines(file_name, dead_letter_file, stats)))
+
+    print(">> Attempting to index the docs using bulk requests ... ")
+    if thread_count > 1:
+        results = helpers.parallel_bulk(es, docs, thread_count=thread_count, chunk_size=chunk_size,
+                                        raise_on_error=False, raise_on_exception=False, **kwargs)
+    else:
+        results = helpers.streaming_bulk(es, docs, chunk_size=chunk_size, max_retries=BULK_MAX_RETRIES,
+                                         raise_on_error=False, raise_on_exception=False, **kwargs)
+
+    # The failed documents are written to a file, and only the first errors are kept to be printed, so that the memory
+    # used does not depend on the number of failed documents
+    failed_file = file_name + ".failed"
+    nb_indexed = 0
+    nb_errors = 0
+    errors = []
+    failed = None
     try:
-        print(">> Attempting to index the list of docs using helpers.bulk() ... ")
-        helpers.bulk(es, doc_list)
-    except Exception as e:
-        print("Elasticsearch helpers.bulk() ERROR:", e)
-        quit()
+        for ok, item in results:
+            if ok:
+                nb_indexed += 1
+                continue
+            nb_errors += 1
+            if len(errors) < BULK_MAX_REPORTED_ERRORS:
+                errors.append(item)
+            if failed is None:
+                failed = open(failed_file, 'a', encoding="utf8")
+            failed.write(json.dumps(item, default=str) + '\n')
+    finally:
+        if failed is not None:
+            failed.close()
+
+    print(">> " + str(nb_indexed) + " document(s) indexed, " + str(nb_errors) + " indexing error(s), " +
+          str(stats["malformed"]) + " malformed line(s)")
+    for error in errors:
+        print("Elasticsearch bulk ERROR:", error)
+    if nb_errors:
+        print(">> Failed documents saved in " + failed_file)
+    if stats["malformed"]:
+        print(">> Malformed lines saved in " + dead_letter_file)
 
     return print(">> Load " + file_name + " : finished !")
 
 
+def create_index(index_name, mapping=None):
+    """
+        Function to create an index with an explicit mapping if it does not exist
+        :param index_name: name of the index
+        :param mapping: mapping of the index (INDEX_MAPPING by default)
+    """
+    if mapping is None:
+        mapping = INDEX_MAPPING
+    if not es.indices.exists(index=index_name):
+        print(">> " + index_name + " index created : " + str(es.indices.create(index=index_name,
+                                                                                body={"mappings": mapping})))
+
+
+def start_bulk_load(index_name):
+    """
+        Function to tune an index for a bulk load: the refresh is disabled and the replicas are removed
+        :param index_name: name of the index
+        -> returns the previous settings, to give to end_bulk_load
+    """
+    settings = es.indices.get_settings(index=index_name, include_defaults=True)[index_name]
+    previous = {}
+    for key in ["refresh_interval", "number_of_replicas"]:
+        previous[key] = settings["settings"]["index"].get(key, settings["defaults"]["index"].get(key))
+
+    es.indices.put_settings(index=index_name, body={"index": {"refresh_interval": "-1", "number_of_replicas": 0}})
+    return previous
+
+
+def end_bulk_load(index_name, previous):
+    """
+        Function to restore the settings of an index after a bulk load, then to refresh it and merge its segments
+        :param index_name: name of the index
+        :param previous: settings returned by start_bulk_load
+    """
+    es.indices.put_settings(index=index_name, body={"index": previous})
+    es.indices.refresh(index=index_name)
+    es.indices.forcemerge(index=index_name, max_num_segments=1, request_timeout=3600)
+
+
+def bulk_load(file_name, index_name, chunk_size=BULK_CHUNK_SIZE, thread_count=1):
+    """
+        Function to load an indexed json file in an index created with INDEX_MAPPING, the index settings are tuned for
+        the time of the load (no refresh, no replicas) and restored at the end, even if the load fails
+        :param file_name: name of the JSON file to load
+        :param index_name: name of the index
+        :param chunk_size: number of documents sent in a single bulk request
+        :param thread_count: number of threads sending the bulk requests
+    """
+    create_index(index_name)
+    previous = start_bulk_load(index_name)
+    try:
+        json_to_es_with_bulk(file_name, chunk_size, thread_count, index_name=index_name)
+    finally:
+        end_bulk_load(index_name, previous)
+    print(">> Bulk load of " + file_name + " in " + index_name + " : finished !")
+
+
 def iterate_whole_es(index_name, index_type, chunk_size, process_data_function, _body, field):
     """
         Function to iterate through the whole ES database, and processing the data with the :
@@ -91,12 +377,378 @@ def iterate_whole_es(index_name, index_type, chunk_size, process_data_function,
         try:
             data = es.scroll(scroll_id=sid, scroll='2m')
         except exceptions.NotFoundError:
-            pass
+            # The scroll has expired, stop instead of processing the last chunk again (run_stage can resume the work)
+            print(">> Scroll expired : the iteration is stopped")
+            return
         sid = data['_scroll_id']
         scroll_size = len(data['hits']['hits'])
+    es.clear_scroll(scroll_id=sid, ignore=(404,))
+
+
+def init_slice_worker(slices):
+    """
+        Function called at the start of each worker process of iterate_whole_es_parallel: the worker gets its own
+        Elasticsearch client, and the rate limiters are divided between the workers
+        :param slices: number of worker processes
+    """
+    global es
+    es = Elasticsearch(ES_HOST)
+
+    for rate_limiter in [geocode_rate_limiter, wiki_rate_limiter]:
+        rate_limiter.rate = rate_limiter.rate / slices
+        rate_limiter.capacity = max(1, rate_limiter.capacity // slices)
+        rate_limiter.tokens = min(rate_limiter.tokens, rate_limiter.capacity)
+
+
+def iterate_slice(index_name, index_type, chunk_size, process_data_function, _body, field, slice_id, slices,
+                  progress):
+    """
+        Function to iterate through one slice of the ES database in a worker process of iterate_whole_es_parallel
+        :param index_name: str, the name of the ES index that is to be scrolled
+        :param index_type: str, the doc type of the ES index that is to be scrolled
+        :param chunk_size: number of entries in a single response (not guarantied)
+        :param process_data_function: the function that will be called to process a chunk of responses
+        :param _body: body of Elasticsearch query
+        :param field: a parameter for process_data_function
+        :param slice_id: number of the slice
+        :param slices: number of slices
+        :param progress: queue receiving the number of documents processed in each chunk
+    """
+    body = dict(_body, slice={"id": slice_id, "max": slices})
+    result = None
+    nb_docs = 0
+    data = es.search(
+        index=index_name,
+        scroll='10m',
+        size=chunk_size,
+        body=body
+    )
+    sid = data['_scroll_id']
+    try:
+        while len(data['hits']['hits']) > 0:
+            result = process_data_function(data['hits']['hits'], result, index_name, index_type, field)
+            nb_docs += len(data['hits']['hits'])
+            progress.put((slice_id, len(data['hits']['hits'])))
+
+            data = es.scroll(scroll_id=sid, scroll='2m')
+            sid = data['_scroll_id']
+    finally:
+        es.clear_scroll(scroll_id=sid, ignore=(404,))
+    return nb_docs
+
+
+def iterate_whole_es_parallel(index_name, index_type, chunk_size, process_data_function, _body, field,
+                              slices=os.cpu_count()):
+    """
+        Function to iterate through the whole ES database with several worker processes: the index is split with a
+        sliced scroll, and each slice is processed by its own process (with its own SpaCy model and ES client)
+        :param index_name: str, the name of the ES index that is to be scrolled
+        :param index_type: str, the doc type of the ES index that is to be scrolled
+        :param chunk_size: number of entries in a single response (not guarantied)
+        :param process_data_function: the function that will be called to process a chunk of responses, it must be
+        defined at the top level of a module
+        :param _body: body of Elasticsearch query
+        :param field: a parameter for process_data_function
+        :param slices: number of slices, and of worker processes
+    """
+    if slices <= 1:
+        return iterate_whole_es(index_name, index_type, chunk_size, process_data_function, _body, field)
+
+    # The worker processes are forked, so they start with the SpaCy model already loaded
+    context = multiprocessing.get_context("fork")
+    with context.Manager() as manager:
+        progress = manager.Queue()
+        with context.Pool(processes=slices, initializer=init_slice_worker, initargs=(slices,)) as pool:
+            results = [pool.apply_async(iterate_slice, (index_name, index_type, chunk_size, process_data_function,
+                                                        _body, field, slice_id, slices, progress))
+                       for slice_id in range(slices)]
+
+            total = 0
+            try:
+                while not all(result.ready() for result in results) or not progress.empty():
+                    try:
+                        slice_id, nb_docs = progress.get(timeout=1)
+                    except queue.Empty:
+                        continue
+                    total += nb_docs
+                    print(">> Slice " + str(slice_id) + " : " + str(nb_docs) + " document(s) processed, total : " +
+                          str(total))
+
+                # Raise the exception of a worker if one of them has failed
+                counts = [result.get() for result in results]
+            except KeyboardInterrupt:
+                print(">> Interrupted : stopping the worker processes ...")
+                pool.terminate()
+                raise
+
+    print(">> " + str(sum(counts)) + " document(s) processed by " + str(slices) + " worker processes")
+    return sum(counts)
+
+
+def load_checkpoints(checkpoint_file=CHECKPOINT_FILE):
+    """
+        Function to read the checkpoints of the stages
+        :param checkpoint_file: JSON file of the checkpoints
+    """
+    if not os.path.exists(checkpoint_file):
+        return {}
+    with open(checkpoint_file, encoding="utf8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(stage, checkpoint, checkpoint_file=CHECKPOINT_FILE):
+    """
+        Function to save the checkpoint of a stage, the file is replaced atomically so that a crash can not corrupt it
+        :param stage: name of the stage
+        :param checkpoint: dict {"status": ..., "nb_docs": ..., "search_after": ...}, or None to remove the checkpoint
+        :param checkpoint_file: JSON file of the checkpoints
+    """
+    checkpoints = load_checkpoints(checkpoint_file)
+    if checkpoint is None:
+        checkpoints.pop(stage, None)
+    else:
+        checkpoints[stage] = checkpoint
+
+    folder = os.path.dirname(checkpoint_file)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(checkpoint_file + ".tmp", "w", encoding="utf8") as f:
+        json.dump(checkpoints, f, indent=2)
+    os.replace(checkpoint_file + ".tmp", checkpoint_file)
+
+
+def stage_key(stage, index_name):
+    """
+        Function to get the key of the checkpoint of a stage, the checkpoints are kept by index
+        :param stage: name of the stage
+        :param index_name: name of the index
+    """
+    return index_name + "/" + stage
+
+
+def reset_stage(stage, index_name, checkpoint_file=CHECKPOINT_FILE):
+    """
+        Function to remove the checkpoint of a stage, the next run_stage will process it from the beginning
+        :param stage: name of the stage
+        :param index_name: name of the index
+        :param checkpoint_file: JSON file of the checkpoints
+    """
+    save_checkpoint(stage_key(stage, index_name), None, checkpoint_file)
+
+
+def print_stages_status(checkpoint_file=CHECKPOINT_FILE):
+    """
+        Function to print the status of the stages saved in the checkpoint file
+        :param checkpoint_file: JSON file of the checkpoints
+    """
+    print(">> Status of the stages : ")
+    for stage, checkpoint in load_checkpoints(checkpoint_file).items():
+        print(stage + " : " + checkpoint["status"] + ", " + str(checkpoint.get("nb_docs", 0)) + " document(s) processed")
+
+
+def run_stage(stage, index_name, index_type, chunk_size, process_data_function, _body, field, slices=1,
+              checkpoint_file=CHECKPOINT_FILE, recheck=True):
+    """
+        Function to run a stage of main.py with durable checkpoints: the sort key of the last processed document is
+        saved after each chunk, so that the stage is resumed from this document after a crash. The stage uses
+        search_after instead of a scroll, so it does not depend on a scroll expiration. A chunk with failed updates
+        (BulkUpdateError) or failed lookups (TransientLookupError) is not saved: the stage stops, and it is resumed
+        from this chunk at the next run.
+        :param stage: name of the stage
+        :param index_name: str, the name of the ES index
+        :param index_type: str, the doc type of the ES index
+        :param chunk_size: number of entries in a single response
+        :param process_data_function: the function that will be called to process a chunk of responses
+        :param _body: body of Elasticsearch query, it must select only the documents that are not processed yet
+        :param field: a parameter for process_data_function
+        :param slices: number of worker processes, with more than 1 the stage is run by iterate_whole_es_parallel and
+        it is resumed by _body
+        :param checkpoint_file: JSON file of the checkpoints
+        :param recheck: True to run a finished stage again on the documents still selected by _body (new documents),
+        False for a stage that runs only once on an index
+        -> returns True if the stage is finished, False if it stopped on a failed chunk (the next stages must not run
+        on the documents of this chunk)
+    """
+    key = stage_key(stage, index_name)
+    checkpoint = load_checkpoints(checkpoint_file).get(key, {})
+    if checkpoint.get("status") == "finished":
+        remaining = es.count(index=index_name, body={"query": _body["query"]})["count"] if recheck else 0
+        if not remaining:
+            print(">> Stage " + stage + " : already finished")
+            return True
+        # The new documents are selected by _body, the stage starts again from the beginning
+        print(">> Stage " + stage + " : " + str(remaining) + " document(s) to process since the end of the stage")
+        checkpoint = {"nb_docs": checkpoint.get("nb_docs", 0)}
+
+    nb_docs = checkpoint.get("nb_docs", 0)
+    search_after = checkpoint.get("search_after")
+    if search_after:
+        print(">> Stage " + stage + " : resumed after " + str(nb_docs) + " document(s)")
+
+    try:
+        if slices > 1:
+            save_checkpoint(key, {"status": "running", "nb_docs": nb_docs}, checkpoint_file)
+            nb_docs += iterate_whole_es_parallel(index_name, index_type, chunk_size, process_data_function, _body,
+                                                 field, slices)
+        else:
+            body = dict(_body, sort=STAGE_SORT)
+            result = None
+            while True:
+                if search_after:
+                    body["search_after"] = search_after
+                data = es.search(index=index_name, size=chunk_size, body=body)
+                hits = data['hits']['hits']
+                if not hits:
+                    break
+
+                result = process_data_function(hits, result, index_name, index_type, field)
+
+                # The results of the chunk are written, the chunk is saved as processed
+                search_after = hits[-1]['sort']
+                nb_docs += len(hits)
+                save_checkpoint(key, {"status": "running", "nb_docs": nb_docs, "search_after": search_after},
+                                checkpoint_file)
+                print(">> Stage " + stage + " : " + str(nb_docs) + " document(s) processed")
+    except (BulkUpdateError, TransientLookupError) as e:
+        # The failed chunk is processed again at the next run
+        print(">> Stage " + stage + " : stopped after " + str(nb_docs) + " document(s), " + str(e))
+        save_checkpoint(key, {"status": "failed", "nb_docs": nb_docs, "search_after": search_after}, checkpoint_file)
+        return False
+
+    save_checkpoint(key, {"status": "finished", "nb_docs": nb_docs}, checkpoint_file)
+    return True
+
+
+class BulkUpdateError(Exception):
+    """
+        Exception raised by bulk_update when some actions of a chunk failed
+    """
+
+
+def update_action(index_name, id_index, doc):
+    """
+        Function to create the bulk action of a partial update of a document, the action is typeless as the index
+        created by create_index (Elasticsearch 7 rejects a second mapping type)
+        :param index_name: name of the index
+        :param id_index: id of the document
+        :param doc: fields to add to the document
+    """
+    return {"_op_type": "update", "_index": index_name, "_id": id_index, "doc": doc}
+
+
+def bulk_update(actions, chunk_size=BULK_CHUNK_SIZE, max_retries=BULK_MAX_RETRIES, ignore_conflicts=False):
+    """
+        Function to send the update actions of the enrichers to Elasticsearch with helpers.streaming_bulk, the requests
+        rejected with the 429 status are retried, and the failed actions of the batch are reported with a
+        BulkUpdateError, so that run_stage does not save the chunk as processed
+        :param actions: list of actions created by update_action
+        :param chunk_size: number of actions sent in a single bulk request
+        :param max_retries: number of retries of a rejected request
+        :param ignore_conflicts: True to count the version conflicts (409 status) as successes, for the versioned
+        actions
+    """
+    nb_success = 0
+    errors = []
+    for ok, item in helpers.streaming_bulk(es, actions, chunk_size=chunk_size, max_retries=max_retries,
+                                           raise_on_error=False, raise_on_exception=False):
+        if ok or (ignore_conflicts and list(item.values())[0].get("status") == 409):
+            nb_success += 1
+        else:
+            errors.append(item)
+
+    if errors:
+        print(">> Bulk update : " + str(nb_success) + " document(s) updated, " + str(len(errors)) + " error(s)")
+        for error in errors[:10]:
+            print(error)
+        raise BulkUpdateError(str(len(errors)) + " bulk action(s) failed")
+    return nb_success, errors
+
+
+def clean_text(text, remove_hyphens=False):
+    """
+        Function to remove HTML tags and unnecessary spaces, tabs and empty lines from a text
+        :param text: text to clean
+        :param remove_hyphens: True to replace the hyphens by spaces
+    """
+    text = h.handle(text)
+    text = text.replace("\n\n", " ").replace("\n", " ").replace("\r", " ").replace("\t", " ")
+    if remove_hyphens:
+        text = text.replace("-", " ")
+    return text
+
+
+def normalize_text(text):
+    """
+        Function to get the text saved in a "<field>_clean" field: without HTML tags and with the spaces, tabs and empty
+        lines collapsed into single spaces
+        :param text: text to clean
+    """
+    return " ".join(h.handle(text).split())
+
+
+def clean_fields_of(source, fields):
+    """
+        Function to compute the "<field>_clean" fields of a document
+        :param source: source of the document
+        :param fields: fields to clean
+        -> returns a dict {"<field>_clean": cleaned text}
+    """
+    return {field + "_clean": normalize_text(source[field]) for field in fields if source.get(field) is not None}
+
+
+def text_of(element, field, remove_hyphens=False):
+    """
+        Function to get the cleaned text of a field of an Elasticsearch result, the saved "<field>_clean" field is used if
+        it exists
+        :param element: Elasticsearch result
+        :param field: title field or message field
+        :param remove_hyphens: True to replace the hyphens by spaces
+    """
+    text = element['_source'].get(field + "_clean")
+    if text is None:
+        return clean_text(element['_source'][field], remove_hyphens)
+    return text.replace("-", " ") if remove_hyphens else text
+
+
+def clean_fields(data, previous_result, index_name, index_type, fields):
+    """
+        Function to save the cleaned texts of fields in "<field>_clean" fields, so that they are cleaned once instead of
+        at each query of the dashboard and at each processing, the documents are marked with "cleaned": true
+        :param data: Elasticsearch result received from iterate_whole_es
+        :param previous_result: data of the previous iteration of iterate_whole_es
+        :param index_name: name of the index
+        :param index_type: type of the index
+        :param fields: list of fields to clean (title and/or message)
+    """
+    if not previous_result:
+        previous_result = 0
+
+    actions = [update_action(index_name, element['_id'],
+                             dict(clean_fields_of(element['_source'], fields), cleaned=True))
+               for element in data]
+    bulk_update(actions)
+    return previous_result + len(actions)
+
+
+def pipe_field(data, field, disabled_pipes, batch_size=PIPE_BATCH_SIZE, n_process=PIPE_N_PROCESS,
+               remove_hyphens=False):
+    """
+        Function to stream the field of a chunk of Elasticsearch results through the SpaCy pipeline, it yields the
+        (doc, element) pairs in the order of data
+        :param data: Elasticsearch result received from iterate_whole_es
+        :param field: title field or message field
+        :param disabled_pipes: names of the pipeline components to disable
+        :param batch_size: number of texts buffered by nlp.pipe
+        :param n_process: number of processes used by nlp.pipe
+        :param remove_hyphens: True to replace the hyphens by spaces before the processing
+    """
+    texts = ((text_of(element, field, remove_hyphens), element) for element in data)
+    disable = [name for name in disabled_pipes if name in nlp.pipe_names]
+    return nlp.pipe(texts, as_tuples=True, disable=disable, batch_size=batch_size, n_process=n_process)
 
 
-def pos_tag_field(data, previous_result, index_name, index_type, field):
+def pos_tag_field(data, previous_result, index_name, index_type, field, batch_size=PIPE_BATCH_SIZE,
+                  n_process=PIPE_N_PROCESS):
     """
         Function to add to the indexes the POS Tagging of the words in the title and message fields
         :param data: Elasticsearch result received from iterate_whole_es
@@ -104,30 +756,32 @@ def pos_tag_field(data, previous_result, index_name, index_type, field):
         :param index_name: name of the index
         :param index_type: type of the index
         :param field: title field or message field
+        :param batch_size: number of texts buffered by nlp.pipe
+        :param n_process: number of processes used by nlp.pipe
     """
     if not previous_result:
         previous_result = ""
-    for element in data:
-        # Remove HTML tags from text
-        field_ = h.handle(element['_source'][field])
+    actions = []
+    # Stream the cleaned field (HTML tags, spaces, tabs, empty lines and hyphens removed) through the pipeline
+    for doc, element in pipe_field(data, field, POS_DISABLED_PIPES, batch_size, n_process, remove_hyphens=True):
         id_index = element['_id']
 
-        # Remove unnecessary spaces, tabs and empty lines from text
-        field_ = field_.replace("\n\n", " ").replace("\n", " ").replace("\r", " ").replace("\t", " ").replace("-", " ")
-
-        # Divide field_ into words and add them to the list
-        doc = nlp(field_)
+        # Divide the field into words and add them to the list
         list_tokens = []
         for token in doc:
             list_tokens.append({"token": token.text, "pos_tag": token.pos_})
 
         # print(id_index)
-        es.update(index=index_name, doc_type=index_type, id=id_index, body={'doc': {"pos_tag_" + field: list_tokens}})
+        actions.append(update_action(index_name, id_index, {"pos_tag_" + field: list_tokens}))
         previous_result += str(list_tokens) + '\n'
+
+    # Send the updates of the chunk to Elasticsearch with bulk requests
+    bulk_update(actions)
     return previous_result
 
 
-def ner_person_field(data, previous_result, index_name, index_type, field):
+def ner_person_field(data, previous_result, index_name, index_type, field, batch_size=PIPE_BATCH_SIZE,
+                     n_process=PIPE_N_PROCESS):
     """
         Function to detect the names of persons in the title and message fields
         :param data: Elasticsearch result received from iterate_whole_es
@@ -135,31 +789,33 @@ def ner_person_field(data, previous_result, index_name, index_type, field):
         :param index_name: name of the index
         :param index_type: type of the index
         :param field: title field or message field
+        :param batch_size: number of texts buffered by nlp.pipe
+        :param n_process: number of processes used by nlp.pipe
     """
     if not previous_result:
         previous_result = ""
-    for element in data:
-        # Remove HTML tags from text
-        field_ = h.handle(element['_source'][field])
+    actions = []
+    # Stream the cleaned field (HTML tags, spaces, tabs and empty lines removed) through the pipeline
+    for doc, element in pipe_field(data, field, NER_DISABLED_PIPES, batch_size, n_process):
         id_index = element['_id']
 
-        # Remove unnecessary spaces, tabs and empty lines from text
-        field_ = field_.replace("\n\n", " ").replace("\n", " ").replace("\r", " ").replace("\t", " ")
-
-        # Divide field_ into words and add them to the list if they are a name of a PERSON
-        doc = nlp(field_)
+        # Divide the field into words and add them to the list if they are a name of a PERSON
         list_tokens = []
         for ent in doc.ents:
             if ent.label_ == "PER":
                 list_tokens.append(ent.text)
 
         # print(id_index)
-        es.update(index=index_name, doc_type=index_type, id=id_index, body={'doc': {"ner_per_" + field: list_tokens}})
+        actions.append(update_action(index_name, id_index, {"ner_per_" + field: list_tokens}))
         previous_result += str(list_tokens) + '\n'
+
+    # Send the updates of the chunk to Elasticsearch with bulk requests
+    bulk_update(actions)
     return previous_result
 
 
-def ner_org_field(data, previous_result, index_name, index_type, field):
+def ner_org_field(data, previous_result, index_name, index_type, field, batch_size=PIPE_BATCH_SIZE,
+                  n_process=PIPE_N_PROCESS):
     """
         Function to detect the names of organizations in the title and message fields
         :param data: Elasticsearch result received from iterate_whole_es
@@ -167,31 +823,261 @@ def ner_org_field(data, previous_result, index_name, index_type, field):
         :param index_name: name of the index
         :param index_type: type of the index
         :param field: title field or message field
+        :param batch_size: number of texts buffered by nlp.pipe
+        :param n_process: number of processes used by nlp.pipe
     """
     if not previous_result:
         previous_result = ""
-    for element in data:
-        # Remove HTML tags from text
-        field_ = h.handle(element['_source'][field])
+    actions = []
+    # Stream the cleaned field (HTML tags, spaces, tabs and empty lines removed) through the pipeline
+    for doc, element in pipe_field(data, field, NER_DISABLED_PIPES, batch_size, n_process):
         id_index = element['_id']
 
-        # Remove unnecessary spaces, tabs and empty lines from text
-        field_ = field_.replace("\n\n", " ").replace("\n", " ").replace("\r", " ").replace("\t", " ")
-
-        # Divide field_ into words and add them to the list if they are a name of an ORGANIZATION
-        doc = nlp(field_)
+        # Divide the field into words and add them to the list if they are a name of an ORGANIZATION
         list_tokens = []
         for ent in doc.ents:
             if ent.label_ == "ORG":
                 list_tokens.append(ent.text)
 
         # print(id_index)
-        es.update(index=index_name, doc_type=index_type, id=id_index, body={'doc': {"ner_org_" + field: list_tokens}})
+        actions.append(update_action(index_name, id_index, {"ner_org_" + field: list_tokens}))
         previous_result += str(list_tokens) + '\n'
+
+    # Send the updates of the chunk to Elasticsearch with bulk requests
+    bulk_update(actions)
     return previous_result
 
 
-def ner_loc_field(data, previous_result, index_name, index_type, field):
+def normalize_location(loc):
+    """
+        Function to get the cache key of a location name (lowercase, without repeated spaces)
+        :param loc: name of the location
+    """
+    return " ".join(loc.split()).lower()
+
+
+def geocode_locations(locations, geocode=None, cache_file=GEOCODE_CACHE_FILE, max_workers=GEOCODE_MAX_WORKERS,
+                      rate_limiter=geocode_rate_limiter):
+    """
+        Function to find the geographical coordinates of a list of locations, the distinct names are searched in the
+        persistent cache first, and only the unknown names are sent to the geocoder
+        :param locations: list of location names
+        :param geocode: geocoding function returning an object with latitude and longitude attributes, or None if the
+        location is not found (Nominatim by default)
+        :param cache_file: SQLite file of the cache
+        :param max_workers: maximum number of concurrent requests sent to the geocoder
+        :param rate_limiter: TokenBucket limiting the rate of the requests (None for no limit)
+        -> returns a dict {normalized name: [latitude, longitude] or None}, TransientLookupError is raised (after the
+        other locations are cached) if the geocoder fails for some locations
+    """
+    if geocode is None:
+        geocode = geolocator.geocode
+
+    def lookup(loc):
+        location = geocode(loc)
+        if location is None:
+            return None
+        return [location.latitude, location.longitude]
+
+    # Only the locations not found by the geocoder are cached as misses, the errors (timeout, unavailable service ...)
+    # are not cached
+    return cached_lookup(locations, lookup, cache_file, "geocode", normalize_location, GEOCODE_CACHE_TTL,
+                         GEOCODE_MISS_TTL, max_workers=max_workers, rate_limiter=rate_limiter,
+                         transient_errors=GEOCODE_TRANSIENT_ERRORS)
+
+
+def location_coordinates(loc, coordinates):
+    """
+        Function to build the NER entry of a location, -1 is used when the location is not found
+        :param loc: name of the location
+        :param coordinates: dict returned by geocode_locations
+    """
+    coordinate = coordinates.get(normalize_location(loc))
+    if coordinate is None:
+        lat = -1
+        long = -1
+    else:
+        lat, long = coordinate
+
+    return {'loc': loc, "latitude": lat, "longitude": long}
+
+
+def locations_index_name(index_name):
+    """
+        Function to get the name of the side index of the locations of an index
+        :param index_name: name of the index of the articles
+    """
+    return index_name + "_locations"
+
+
+def location_actions(index_name, id_index, published, field, list_loc):
+    """
+        Function to create the bulk actions indexing the geocoded locations of a document in the side index
+        :param index_name: name of the index of the articles
+        :param id_index: id of the document
+        :param published: publication date of the document
+        :param field: title field or message field
+        :param list_loc: locations of the field, as saved in the ner_loca_ fields
+    """
+    actions = []
+    for i, entry in enumerate(list_loc):
+        if entry["latitude"] in [None, -1] or entry["longitude"] in [None, -1]:
+            continue
+        actions.append({"_op_type": "index", "_index": locations_index_name(index_name),
+                        "_id": str(id_index) + "_" + field + "_" + str(i),
+                        "_source": {"article_id": id_index, "field": field, "published": published, "loc": entry["loc"],
+                                    "location": {"lat": entry["latitude"], "lon": entry["longitude"]}}})
+    return actions
+
+
+def locations_to_index(data, previous_result, index_name, index_type, fields):
+    """
+        Function to copy the locations already saved in the ner_loca_ fields to the side index of the locations
+        :param data: Elasticsearch result received from iterate_whole_es
+        :param previous_result: data of the previous iteration of iterate_whole_es
+        :param index_name: name of the index
+        :param index_type: type of the index
+        :param fields: list of fields (title and/or message)
+    """
+    if not previous_result:
+        previous_result = 0
+    actions = []
+    for element in data:
+        for field in fields:
+            actions += location_actions(index_name, element['_id'], element['_source']['published'], field,
+                                        element['_source'].get("ner_loca_" + field) or [])
+
+    bulk_update(actions)
+    return previous_result + len(actions)
+
+
+def daily_tokens_index_name(index_name):
+    """
+        Function to get the name of the side index of the daily tokens of an index
+        :param index_name: name of the index of the articles
+    """
+    return index_name + "_daily_tokens"
+
+
+def article_tokens_index_name(index_name):
+    """
+        Function to get the name of the side index of the words of the articles of an index
+        :param index_name: name of the index of the articles
+    """
+    return index_name + "_article_tokens"
+
+
+def token_id(token):
+    """
+        Function to get the part of an id built from a word, the SHA-1 of the word (a word can be longer than the 512
+        bytes allowed for an id)
+        :param token: word
+    """
+    return hashlib.sha1(token.encode("utf-8")).hexdigest()
+
+
+def daily_token_counts(list_pos_tags):
+    """
+        Function to count the words of the bubble chart (BUBBLE_POS_TAGS) of a document
+        :param list_pos_tags: POS tags of the fields of the document, as saved in the pos_tag_ fields
+        -> returns a Counter {token: count}
+    """
+    counts = Counter()
+    for pos_tags_of_field in list_pos_tags:
+        for pos in pos_tags_of_field or []:
+            if pos['pos_tag'] in BUBBLE_POS_TAGS:
+                counts[pos['token']] += 1
+    return counts
+
+
+def daily_token_actions(index_name, id_index, published, list_pos_tags):
+    """
+        Function to create the bulk actions indexing the counts of words of a document in the side index of the words of
+        the articles, the id is the id of the document followed by the SHA-1 of the word
+        :param index_name: name of the index of the articles
+        :param id_index: id of the document
+        :param published: publication date of the document
+        :param list_pos_tags: POS tags of the fields of the document, as saved in the pos_tag_ fields
+    """
+    return [{"_op_type": "index", "_index": article_tokens_index_name(index_name),
+             "_id": str(id_index) + "_" + token_id(token),
+             "_source": {"article_id": id_index, "day": published[:10], "token": token, "count": count}}
+            for token, count in daily_token_counts(list_pos_tags).items()]
+
+
+def rollup_daily_tokens(index_name, days, size=DAILY_TOKENS_TOP):
+    """
+        Function to compute again the most frequent words of some days from the side index of the words of the
+        articles, the words are saved in the side index of the daily tokens (id: day and SHA-1 of the word), and the
+        words of these days that are no longer among the most frequent are removed. Each computation is versioned by
+        its start time, so that the computations of parallel workers on the same day keep the newest one.
+        :param index_name: name of the index of the articles
+        :param days: days (YYYY-MM-DD) of the processed documents
+        :param size: number of words kept per day
+    """
+    days = sorted(days)
+    if not days:
+        return 0
+    # The words of the articles written before this time are counted by the computation
+    computed = int(time.time() * 1000)
+    es.indices.refresh(index=article_tokens_index_name(index_name))
+    result = es.search(index=article_tokens_index_name(index_name), body={
+        "query": {"terms": {"day": days}},
+        "size": 0,
+        "aggs": {
+            "days": {
+                "terms": {"field": "day", "size": len(days), "format": "yyyy-MM-dd"},
+                "aggs": {
+                    "tokens": {
+                        "terms": {"field": "token", "size": size, "order": {"total": "desc"}},
+                        "aggs": {"total": {"sum": {"field": "count"}}}
+                    }
+                }
+            }
+        }
+    })
+
+    actions = [{"_op_type": "index", "_index": daily_tokens_index_name(index_name),
+                "_id": day["key_as_string"] + "_" + token_id(token["key"]),
+                "version": computed, "version_type": "external_gte",
+                "_source": {"day": day["key_as_string"], "token": token["key"], "count": int(token["total"]["value"]),
+                            "computed": computed}}
+               for day in result["aggregations"]["days"]["buckets"] for token in day["tokens"]["buckets"]]
+    # a conflict means that a newer computation has already saved the word
+    bulk_update(actions, ignore_conflicts=True)
+
+    # Remove the words of the older computations of these days that are not among the most frequent words anymore
+    es.indices.refresh(index=daily_tokens_index_name(index_name))
+    es.delete_by_query(index=daily_tokens_index_name(index_name), conflicts="proceed", body={
+        "query": {"bool": {"filter": [{"terms": {"day": days}}, {"range": {"computed": {"lt": computed}}}],
+                           "must_not": {"ids": {"values": [action["_id"] for action in actions]}}}}})
+    return len(actions)
+
+
+def daily_tokens_to_index(data, previous_result, index_name, index_type, fields):
+    """
+        Function to add the words already saved in the pos_tag_ fields to the side index of the words of the articles,
+        and to compute again the most frequent words of their days
+        :param data: Elasticsearch result received from iterate_whole_es
+        :param previous_result: data of the previous iteration of iterate_whole_es
+        :param index_name: name of the index
+        :param index_type: type of the index
+        :param fields: list of fields (title and/or message)
+    """
+    if not previous_result:
+        previous_result = 0
+    actions = []
+    for element in data:
+        actions += daily_token_actions(index_name, element['_id'], element['_source']['published'],
+                                       [element['_source'].get("pos_tag_" + field) for field in fields])
+
+    bulk_update(actions)
+    rollup_daily_tokens(index_name, {element['_source']['published'][:10] for element in data})
+    return previous_result + len(actions)
+
+
+def ner_loc_field(data, previous_result, index_name, index_type, field, batch_size=PIPE_BATCH_SIZE,
+                  n_process=PIPE_N_PROCESS, geocode=None):
     """
         Function to detect the names of places in the title and message fields
         :param data: Elasticsearch result received from iterate_whole_es
@@ -199,52 +1085,191 @@ def ner_loc_field(data, previous_result, index_name, index_type, field):
         :param index_name: name of the index
         :param index_type: type of the index
         :param field: title field or message field
+        :param batch_size: number of texts buffered by nlp.pipe
+        :param n_process: number of processes used by nlp.pipe
+        :param geocode: geocoding function given to geocode_locations (Nominatim by default), a local stub is given to
+        run_stage with functools.partial(..., geocode=...), it must be defined at the top level of a module for the
+        worker processes
     """
     if not previous_result:
         previous_result = ""
-    for element in data:
-        # Remove HTML tags from text
-        field_ = h.handle(element['_source'][field])
+    actions = []
+    side_actions = []
+    locations = []
+    # Stream the cleaned field (HTML tags, spaces, tabs and empty lines removed) through the pipeline
+    for doc, element in pipe_field(data, field, NER_DISABLED_PIPES, batch_size, n_process):
+        # Divide the field into words and keep them if they are a name of a PLACE
+        locations.append((element, [ent.text for ent in doc.ents if ent.label_ == "LOC"]))
+
+    # Find the geographical coordinates of the distinct locations of the chunk
+    coordinates = geocode_locations([loc for _, list_loc in locations for loc in list_loc], geocode=geocode)
+
+    for element, list_loc in locations:
         id_index = element['_id']
+        list_tokens = [location_coordinates(loc, coordinates) for loc in list_loc]
 
-        # Remove unnecessary spaces, tabs and empty lines from text
-        field_ = field_.replace("\n\n", " ").replace("\n", " ").replace("\r", " ").replace("\t", " ")
+        # print(id_index)
+        actions.append(update_action(index_name, id_index, {"ner_loca_" + field: list_tokens}))
+        side_actions += location_actions(index_name, id_index, element['_source']['published'], field, list_tokens)
+        previous_result += str(list_tokens) + '\n'
 
-        # Divide field_ into words and add them to the list if they are a name of a PLACE
-        doc = nlp(field_)
-        list_tokens = []
-        for ent in doc.ents:
-            if ent.label_ == "LOC":
-                loc = ent.text
+    # Send the updates of the chunk to Elasticsearch with bulk requests, the side index first so that a document is
+    # only marked as processed once its locations are saved
+    bulk_update(side_actions)
+    bulk_update(actions)
+    return previous_result
 
-                # Find the geographical coordinates of the location
-                location = geolocator.geocode(loc, exactly_one=False)
-                if location is None:
-                    lat = -1
-                    long = -1
-                else:
-                    lat = geolocator.geocode(ent.text).latitude
-                    long = geolocator.geocode(ent.text).longitude
 
-                list_tokens.append({'loc': loc, "latitude": lat, "longitude": long})
+def pos_tags(doc):
+    """
+        Function to get the POS Tagging of the words of a SpaCy doc
+        :param doc: SpaCy doc of a cleaned field
+    """
+    list_tokens = []
+    for token in doc:
+        # The hyphens are removed from the words, as pos_tag_field does before the processing of the text
+        for part in token.text.split("-"):
+            if part:
+                list_tokens.append({"token": part, "pos_tag": token.pos_})
+    return list_tokens
 
-        # print(id_index)
-        es.update(index=index_name, doc_type=index_type, id=id_index, body={'doc': {"ner_loca_" + field: list_tokens}})
-        previous_result += str(list_tokens) + '\n'
+
+def annotate_fields(data, previous_result, index_name, index_type, fields, batch_size=PIPE_BATCH_SIZE,
+                    n_process=PIPE_N_PROCESS, geocode=None):
+    """
+        Function to add to the indexes the POS Tagging and the NERs (PER, ORG and LOC) of several fields, each field is
+        processed only once by the SpaCy pipeline, the geocoded locations and the words of the bubble chart are also
+        added to the side indexes
+        :param data: Elasticsearch result received from iterate_whole_es
+        :param previous_result: data of the previous iteration of iterate_whole_es
+        :param index_name: name of the index
+        :param index_type: type of the index
+        :param fields: list of fields to process (title and/or message), the processed documents are marked with
+        "annotated": true
+        :param batch_size: number of texts buffered by nlp.pipe
+        :param n_process: number of processes used by nlp.pipe
+        :param geocode: geocoding function given to geocode_locations (Nominatim by default), a local stub is given to
+        run_stage with functools.partial(..., geocode=...), it must be defined at the top level of a module for the
+        worker processes
+    """
+    if not previous_result:
+        previous_result = ""
+    actions = []
+    side_actions = []
+
+    # Stream all the fields of the chunk through the pipeline, the context keeps the document and the field name
+    texts = ((text_of(element, field), (element, field)) for element in data for field in fields)
+    disable = [name for name in ["parser", "lemmatizer"] if name in nlp.pipe_names]
+
+    annotations = {}
+    published = {element['_id']: element['_source']['published'] for element in data}
+    for doc, (element, field) in nlp.pipe(texts, as_tuples=True, disable=disable, batch_size=batch_size,
+                                          n_process=n_process):
+        annotation = annotations.setdefault(element['_id'], {"annotated": True})
+        if field + "_clean" not in element['_source']:
+            annotation.update(clean_fields_of(element['_source'], [field]))
+        annotation["pos_tag_" + field] = pos_tags(doc)
+        annotation["ner_per_" + field] = [ent.text for ent in doc.ents if ent.label_ == "PER"]
+        annotation["ner_org_" + field] = [ent.text for ent in doc.ents if ent.label_ == "ORG"]
+        annotation["ner_loca_" + field] = [ent.text for ent in doc.ents if ent.label_ == "LOC"]
+
+    # Find the geographical coordinates of the distinct locations of the chunk
+    coordinates = geocode_locations([loc for annotation in annotations.values() for field in fields
+                                     for loc in annotation["ner_loca_" + field]], geocode=geocode)
+
+    for id_index, annotation in annotations.items():
+        for field in fields:
+            annotation["ner_loca_" + field] = [location_coordinates(loc, coordinates)
+                                               for loc in annotation["ner_loca_" + field]]
+            side_actions += location_actions(index_name, id_index, published[id_index], field,
+                                             annotation["ner_loca_" + field])
+        # Add the words of the document to the side index of the daily tokens
+        side_actions += daily_token_actions(index_name, id_index, published[id_index],
+                                            [annotation["pos_tag_" + field] for field in fields])
+        actions.append(update_action(index_name, id_index, annotation))
+        previous_result += str(annotation) + '\n'
+
+    # Send the updates of the chunk to Elasticsearch with bulk requests, the side indexes first so that a document is
+    # only marked as annotated once its locations and words (and the words of its day) are saved (a failure leaves it to
+    # the next run)
+    bulk_update(side_actions)
+    rollup_daily_tokens(index_name, {day[:10] for day in published.values()})
+    bulk_update(actions)
     return previous_result
 
 
-def wiki_field(data, previous_result, index_name, index_type, field):
+def wikipedia_lookup(org, rate_limiter=None):
+    """
+        Function to search the wikipedia definition of an organization and the link to its web page
+        :param org: name of the organization
+        :param rate_limiter: TokenBucket of the second request (the page), the first one is limited by the caller
+        -> returns a dict {"status": "found", "missing" or "disambiguation", "info": definition, "link": link}
+    """
+    try:
+        # Get the first 3 sentences of wikipedia definition
+        info = wikipedia.summary(org, sentences=3)
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        link = wikipedia.page(org).url
+    except wikipedia.exceptions.PageError:
+        return {"status": "missing", "info": "", "link": " "}
+    # Ignore terms that are ambiguous
+    except wikipedia.exceptions.DisambiguationError:
+        return {"status": "disambiguation", "info": "", "link": " "}
+
+    return {"status": "found", "info": info, "link": link}
+
+
+def normalize_organization(org):
+    """
+        Function to get the cache key of an organization name (without repeated spaces)
+        :param org: name of the organization
+    """
+    return " ".join(org.split())
+
+
+def resolve_organizations(orgs, lookup=None, cache_file=WIKI_CACHE_FILE, max_workers=WIKI_MAX_WORKERS,
+                          rate_limiter=wiki_rate_limiter):
+    """
+        Function to find the wikipedia definitions and links of a list of organizations, the distinct names are
+        searched in the persistent cache first, and only the unknown names are sent to the lookup backend
+        :param orgs: list of organization names
+        :param lookup: function returning the result of an organization as wikipedia_lookup does (the wikipedia API by
+        default), an offline dump or a local stub can be used instead
+        :param cache_file: SQLite file of the cache
+        :param max_workers: maximum number of concurrent requests sent to the backend
+        :param rate_limiter: TokenBucket limiting the rate of the requests (None for no limit)
+        -> returns a dict {normalized name: result of lookup}
+    """
+    if lookup is None:
+        # wikipedia_lookup sends two requests, each one takes a token of the rate limiter
+        lookup = functools.partial(wikipedia_lookup, rate_limiter=rate_limiter)
+
+    return cached_lookup(orgs, lookup, cache_file, "wikipedia", normalize_organization, WIKI_CACHE_TTL, WIKI_MISS_TTL,
+                         is_miss=lambda value: value["status"] != "found", max_workers=max_workers,
+                         rate_limiter=rate_limiter, transient_errors=WIKI_TRANSIENT_ERRORS)
+
+
+def wiki_field(data, previous_result, index_name, index_type, field, lookup=None):
     """
         Function to add wikipedia definitions of the organizations and links to their web pages
         :param data: Elasticsearch result received from iterate_whole_es
         :param previous_result: data of the previous iteration of iterate_whole_es
         :param index_name: name of the index
         :param index_type: type of the index
-        :param field: title field or message field
+        :param field: title field or message field, the processed documents are marked with
+        "wikied_<field>": true
+        :param lookup: lookup backend given to resolve_organizations (the wikipedia API by default), an offline dump
+        or a local stub is given to run_stage with functools.partial(wiki_field, lookup=...)
     """
     if not previous_result:
         previous_result = ""
+    actions = []
+
+    # Find the wikipedia pages of the distinct organizations of the chunk
+    pages = resolve_organizations([org for element in data for org in element['_source']["ner_org_" + field] or []],
+                                  lookup=lookup)
+
     for element in data:
         field_ = element['_source']["ner_org_" + field]
         id_index = element['_id']
@@ -252,23 +1277,15 @@ def wiki_field(data, previous_result, index_name, index_type, field):
         list_wiki = []
         if field_:
             for org in field_:
-                info = ""
-                link = " "
-                try:
-                    # Get the first 3 sentences of wikipedia definition
-                    info = wikipedia.summary(org, sentences=3)
-                    link = wikipedia.page(org).url
-                except wikipedia.exceptions.PageError:
-                    pass
-                # Ignore terms that are ambiguous
-                except wikipedia.exceptions.DisambiguationError:
-                    pass
-
-                list_wiki.append({"org": org, "info": info, "link": link})
+                page = pages[normalize_organization(org)]
+                list_wiki.append({"org": org, "info": page["info"], "link": page["link"]})
 
         # print(id_index)
-        es.update(index=index_name, doc_type=index_type, id=id_index, body={'doc': {"wiki_" + field: list_wiki}})
+        actions.append(update_action(index_name, id_index, {"wiki_" + field: list_wiki, "wikied_" + field: True}))
         previous_result += str(list_wiki) + '\n'
+
+    # Send the updates of the chunk to Elasticsearch with bulk requests
+    bulk_update(actions)
     return previous_result
 
 
@@ -376,6 +1393,51 @@ def merge_csv_files(file_name_1, file_name_2, file_name_3, final_file):
     output2.to_csv(final_file, index=False)
 
 
+def parse_ner_list(cell):
+    """
+        Function to get the list saved as a string in a cell of the csv files of the NERs
+        :param cell: cell of the csv file (empty if the document is missing in one of the merged files)
+    """
+    if isinstance(cell, str):
+        return ast.literal_eval(cell)
+    return []
+
+
+def ners_to_parquet(csv_file, parquet_folder):
+    """
+        Function to save the merged NERs csv file as a Parquet dataset partitioned by day, with list columns instead of
+        lists saved as strings, so that the network graph reads only the rows of the selected day without parsing them
+        :param csv_file: merged csv file of the NERs
+        :param parquet_folder: folder of the Parquet dataset (replaced if it exists)
+    """
+    # pyarrow is only needed by this storage of the NERs
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    data = pd.read_csv(csv_file)
+    for column in ["NERs_org", "NERs_per", "NERs_loca"]:
+        data[column] = data[column].map(parse_ner_list)
+    data['id'] = data['id'].astype(str)
+    data['date'] = data['date'].astype(str)
+    data['day'] = data['date'].str[:10]
+
+    schema = pa.schema([
+        ("date", pa.string()),
+        ("id", pa.string()),
+        ("NERs_org", pa.list_(pa.string())),
+        ("NERs_loca", pa.list_(pa.struct([("loc", pa.string()), ("latitude", pa.float64()),
+                                          ("longitude", pa.float64())]))),
+        ("NERs_per", pa.list_(pa.string())),
+        ("day", pa.string())
+    ])
+    table = pa.Table.from_pandas(data[schema.names], schema=schema, preserve_index=False)
+
+    if os.path.isdir(parquet_folder):
+        shutil.rmtree(parquet_folder)
+    pq.write_to_dataset(table, parquet_folder, partition_cols=["day"])
+    print(">> File : " + csv_file + " saved in the Parquet dataset " + parquet_folder)
+
+
 def delete_csv_file(file_name):
     """
         Function to delete a csv file
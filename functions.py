@@ -1,13 +1,19 @@
 import ast
+import json
+import math
+import os
+import threading
 import warnings
-from collections import Counter
+from collections import Counter, OrderedDict
 from datetime import datetime
 
 import html2text as html2text
 import pandas as pd
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, exceptions
 from wordcloud import WordCloud
 
+from cache import QueryCache, SqliteBackend, cached_query
+
 # Ignore FutureWarning
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
@@ -18,7 +24,125 @@ h.ignore_links = True
 # Create instance of Elasticsearch
 es = Elasticsearch("http://localhost:9200")
 
+# Cache of the results of the queries (LRU of 256 entries kept 10 minutes), it is shared by the workers of the server
+# through a SQLite file if the QUERY_CACHE_FILE environment variable is set
+query_cache = QueryCache(maxsize=256, ttl=600,
+                         backend=SqliteBackend(os.environ["QUERY_CACHE_FILE"]) if os.environ.get("QUERY_CACHE_FILE")
+                         else None)
+
+# Cache of the metadata of the index (extreme dates), apart from the results of the queries so that they are not removed
+# by the LRU, they are computed again every hour to follow the new articles
+INDEX_METADATA_TTL = 3600
+metadata_cache = QueryCache(maxsize=16, ttl=INDEX_METADATA_TTL, backend=query_cache.backend)
+
+# Maximum number of locations displayed in the map chart
+MAP_MAX_LOCATIONS = 1000
+
+# Format of the dates of the "published" field in the Elasticsearch results
+PUBLISHED_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+# Paged data table: number of rows of a page, number of pages fetched in advance after the requested page (and kept
+# before it), lifetime of the point in time of a search, maximum number of searches kept open, and maximum from + size
+# of a search (index.max_result_window of Elasticsearch)
+TABLE_PAGE_SIZE = 20
+TABLE_PREFETCH_PAGES = 2
+TABLE_PIT_KEEP_ALIVE = "5m"
+TABLE_MAX_CURSORS = 32
+TABLE_MAX_RESULT_WINDOW = 10000
+
+# Columns of the data table that can be sorted, and their fields in Elasticsearch
+TABLE_SORT_FIELDS = {"Date": "published"}
+
+# The Time column is sorted by the time of day of the publication, computed by a script since the published field
+# holds the whole timestamp
+TABLE_TIME_OF_DAY_SCRIPT = ("ZonedDateTime d = doc['published'].value; "
+                            "return d.getHour() * 3600 + d.getMinute() * 60 + d.getSecond();")
+
+# Open searches of the data table: {key of the search: {"pit": id, "pages": {page: rows} of the pages around the last
+# requested page, "after": {page: sort values of its last article}, "total": number of articles}}
+table_cursors = OrderedDict()
+table_cursors_lock = threading.Lock()
+
+# Tables of the network graph kept in memory, they are loaded again only when their file is modified:
+# {file name: (modification time, table)}
+table_store = {}
+table_store_lock = threading.Lock()
+
+
+class QueryCancelled(Exception):
+    """
+        Exception raised when a query is stopped because a newer query of the same session replaced it
+    """
+
+
+class LatestRequests:
+    """
+        Registry of the last request of each (session, component): starting a request cancels the previous request of
+        the same key. The requests are numbered by a single counter, so a key removed beyond maxsize does not cancel its
+        running request, and a new request of this key still cancels it
+    """
 
+    def __init__(self, maxsize=1024):
+        """
+            :param maxsize: maximum number of keys kept (the oldest keys are removed beyond)
+        """
+        self.maxsize = maxsize
+        self.generations = OrderedDict()
+        self.last_generation = 0
+        self.lock = threading.Lock()
+
+    def start(self, key):
+        """
+            Function to register a new request of a key
+            :param key: (session id, component id)
+            -> returns a function returning True when a newer request of the same key has been started
+        """
+        with self.lock:
+            self.last_generation += 1
+            generation = self.last_generation
+            self.generations[key] = generation
+            self.generations.move_to_end(key)
+            while len(self.generations) > self.maxsize:
+                self.generations.popitem(last=False)
+
+        def is_cancelled():
+            # a removed key has no newer request
+            return self.generations.get(key, generation) != generation
+
+        return is_cancelled
+
+
+# Last request of the slow callbacks of each session, the previous requests are cancelled
+latest_requests = LatestRequests()
+
+
+def run_unless_cancelled(is_cancelled, function, *args, **kwargs):
+    """
+        Function to call a cancellable function (reduced_scroll), QueryCancelled is raised if the request is
+        superseded. A call shared with the request of another session (see cached_query) is run again if only this
+        other request was cancelled
+        :param is_cancelled: function returned by LatestRequests.start
+        :param function: function accepting an is_cancelled argument
+    """
+    while True:
+        try:
+            return function(*args, is_cancelled=is_cancelled, **kwargs)
+        except QueryCancelled:
+            if is_cancelled():
+                raise
+
+
+def parse_published(values):
+    """
+        Function to convert "published" dates saved by Elasticsearch into timestamps, all the dates are converted by a
+        single call of pandas
+        :param values: list of dates in PUBLISHED_FORMAT
+        -> returns a Series of timestamps (use .dt.date and .dt.time to split them)
+    """
+    return pd.to_datetime(pd.Series(values, dtype=object), format=PUBLISHED_FORMAT)
+
+
+@cached_query(query_cache)
 def docs_per_periode(start_date, end_date, interval, index_name):
     """
         Function to calculate the number of articles published between two dates according to a time interval
@@ -49,20 +173,18 @@ def docs_per_periode(start_date, end_date, interval, index_name):
         }
     })
 
-    dates = []
-    time = []
-    count = []
-    for doc in result["aggregations"]["title"]["buckets"]:
-        dates.append(pd.to_datetime(doc['key_as_string'], format='%Y-%m-%dT%H:%M:%S.%fZ').date())
-        time.append(pd.to_datetime(doc['key_as_string'], format='%Y-%m-%dT%H:%M:%S.%fZ').time())
-        count.append(doc['doc_count'])
+    buckets = result["aggregations"]["title"]["buckets"]
+    published = parse_published([doc['key_as_string'] for doc in buckets])
 
-    return pd.DataFrame({'date': dates, 'time': time, 'nb': count})
+    return pd.DataFrame({'date': published.dt.date, 'time': published.dt.time,
+                         'nb': [doc['doc_count'] for doc in buckets]})
 
 
+@cached_query(metadata_cache)
 def extreme_dates(index_name):
     """
-        Function to determine extreme dates of the "published" field for the entire Elasticsearch database
+        Function to determine extreme dates of the "published" field for the entire Elasticsearch database, the result
+        is computed again every INDEX_METADATA_TTL seconds
         :param index_name: name of the Elasticsearch index
         -> used for LIVE GRAPH, DatePickerRange & DatePickerSingle
     """
@@ -70,6 +192,7 @@ def extreme_dates(index_name):
     result = es.search(
         index=index_name,
         body={
+            "size": 0,
             "aggs": {
                 "minmax": {
                     "stats": {
@@ -87,6 +210,7 @@ def extreme_dates(index_name):
     return date_min, date_max
 
 
+@cached_query(query_cache)
 def significant_words(start_date, end_date, index_name):
     """
         Function to determine the most frequent words for the "title" field for the entire Elasticsearch database
@@ -152,7 +276,7 @@ def plot_wordcloud(data):
     return wc.to_image()
 
 
-def iterate_whole_es(index_name, chunk_size, process_data_function, query):
+def iterate_whole_es(index_name, chunk_size, process_data_function, query, is_cancelled=None):
     """
         Function to iterate through the whole ES database, and processing the data with the :
         :param process_data_function: the function that will be called to process a chunk of responses, it will receive
@@ -160,6 +284,8 @@ def iterate_whole_es(index_name, chunk_size, process_data_function, query):
         :param chunk_size: number of entries in a single response (not guarantied)
         :param index_name: str, the name of the ES index that is to be scrolled
         :param query: body of Elasticsearch query
+        :param is_cancelled: function returning True when the query is superseded, QueryCancelled is then raised (None
+        to never cancel the query)
         -> used for MAP CHART, BUBBLE CHART & DATA TABLE
     """
     body = query
@@ -172,15 +298,42 @@ def iterate_whole_es(index_name, chunk_size, process_data_function, query):
     )
 
     sid = data['_scroll_id']
-    scroll_size = len(data['hits']['hits'])
-    while scroll_size > 0:
-        result = process_data_function(data['hits']['hits'], result)
-        data = es.scroll(scroll_id=sid, scroll='2m')
-        sid = data['_scroll_id']
+    try:
         scroll_size = len(data['hits']['hits'])
+        while scroll_size > 0:
+            # A superseded query stops before fetching the next chunk
+            if is_cancelled is not None and is_cancelled():
+                raise QueryCancelled()
+            result = process_data_function(data['hits']['hits'], result)
+            data = es.scroll(scroll_id=sid, scroll='2m')
+            sid = data['_scroll_id']
+            scroll_size = len(data['hits']['hits'])
+    finally:
+        # The scroll is released at the end (or at the cancellation) instead of waiting for its expiration
+        try:
+            es.clear_scroll(scroll_id=sid)
+        except exceptions.NotFoundError:
+            pass
     return result
 
 
+@cached_query(query_cache)
+def reduced_scroll(index_name, chunk_size, process_data_function, reduce_function, query, is_cancelled=None):
+    """
+        Function to iterate through the whole ES database with iterate_whole_es and to reduce its result, only the
+        reduced result is cached (the result of iterate_whole_es can hold all the articles of the period)
+        :param index_name: str, the name of the ES index that is to be scrolled
+        :param chunk_size: number of entries in a single response (not guarantied)
+        :param process_data_function: the function that will be called to process a chunk of responses
+        :param reduce_function: function called with the result of iterate_whole_es (locations_processing,
+        tokens_size ...)
+        :param query: body of Elasticsearch query
+        :param is_cancelled: function returning True when the query is superseded (None to never cancel the query)
+        -> used for MAP CHART & BUBBLE CHART
+    """
+    return reduce_function(iterate_whole_es(index_name, chunk_size, process_data_function, query, is_cancelled))
+
+
 def data_table(data, previous_result):
     """
         Function to collect data [title, date, time, link]  for data table, title field must contain the search term
@@ -191,11 +344,16 @@ def data_table(data, previous_result):
     if not previous_result:
         previous_result = []
 
-    for element in data:
-        title = h.handle(element['_source']['title'])
-        title = title.replace("\n\n", " ").replace("\n", " ").replace("\r", " ").replace("\t", " ").replace("-", " ")
-        date = pd.to_datetime(element["_source"]["published"], format='%Y-%m-%dT%H:%M:%S.%fZ').date()
-        time = pd.to_datetime(element["_source"]["published"], format='%Y-%m-%dT%H:%M:%S.%fZ').time()
+    # The dates of the chunk are converted together
+    published = parse_published([element["_source"]["published"] for element in data])
+
+    for element, date, time in zip(data, published.dt.date, published.dt.time):
+        # the cleaned title is saved at the load (or by the "clean" stage of main.py) for the recent indexes
+        title = element['_source'].get('title_clean')
+        if title is None:
+            title = h.handle(element['_source']['title'])
+            title = title.replace("\n\n", " ").replace("\n", " ").replace("\r", " ").replace("\t", " ")
+        title = title.replace("-", " ")
 
         previous_result.append({"Title": title,
                                 "Date": date,
@@ -204,6 +362,148 @@ def data_table(data, previous_result):
     return previous_result
 
 
+def table_query(start_date, end_date, word):
+    """
+        Function to build the query of the data table: the articles published between two dates, and containing the
+        search term in their title if it is not empty
+        :param start_date: start date
+        :param end_date: end date
+        :param word: search term
+        -> used for DATA TABLE
+    """
+    must = [{"range": {"published": {"gte": start_date, "lte": end_date}}}]
+    if word:
+        must.append({"multi_match": {"query": word, "fields": ["title"]}})
+    return {"bool": {"must": must}}
+
+
+def table_sort(sort_by):
+    """
+        Function to convert the sort_by property of the data table to an Elasticsearch sort (by publication date by
+        default, the Title and Link columns are not sorted)
+        :param sort_by: list of {"column_id": ..., "direction": "asc" or "desc"}
+        -> used for DATA TABLE
+    """
+    for column in sort_by or []:
+        if column["column_id"] in TABLE_SORT_FIELDS:
+            return [{TABLE_SORT_FIELDS[column["column_id"]]: {"order": column["direction"]}}]
+        if column["column_id"] == "Time":
+            # the articles published at the same time of day are sorted by date
+            return [{"_script": {"type": "number", "order": column["direction"],
+                                 "script": {"lang": "painless", "source": TABLE_TIME_OF_DAY_SCRIPT}}},
+                    {"published": {"order": column["direction"]}}]
+    return [{"published": {"order": "asc"}}]
+
+
+def open_table_cursor(index_name):
+    """
+        Function to open a point in time on the index for a search of the data table
+        :param index_name: name of the Elasticsearch index
+    """
+    pit = es.open_point_in_time(index=index_name, keep_alive=TABLE_PIT_KEEP_ALIVE)["id"]
+    return {"pit": pit, "pages": {}, "after": {}, "total": 0}
+
+
+def close_table_cursor(cursor):
+    """
+        Function to close the point in time of a search of the data table
+        :param cursor: search returned by open_table_cursor
+    """
+    try:
+        es.close_point_in_time(body={"id": cursor["pit"]})
+    except exceptions.NotFoundError:
+        pass
+
+
+def table_page(index_name, query, sort, page_current, page_size=TABLE_PAGE_SIZE):
+    """
+        Function to get a page of the data table with a point in time: the requested page (plus TABLE_PREFETCH_PAGES
+        pages) is fetched with search_after after a nearby page, or with from within max_result_window, and only the
+        pages around it are kept for the next calls (with the sort values of the last article of each page)
+        :param index_name: name of the Elasticsearch index
+        :param query: query returned by table_query
+        :param sort: sort returned by table_sort
+        :param page_current: number of the page (from 0)
+        :param page_size: number of rows of a page
+        -> returns the rows of the page, and the number of articles found
+        -> used for DATA TABLE
+    """
+    key = json.dumps([index_name, query, sort, page_size], sort_keys=True)
+    with table_cursors_lock:
+        cursor = table_cursors.get(key)
+        if cursor is not None:
+            table_cursors.move_to_end(key)
+    if cursor is None:
+        new_cursor = dict(open_table_cursor(index_name), lock=threading.Lock())
+        with table_cursors_lock:
+            # another callback may have opened the same search in the meantime
+            cursor = table_cursors.setdefault(key, new_cursor)
+            while len(table_cursors) > TABLE_MAX_CURSORS:
+                close_table_cursor(table_cursors.popitem(last=False)[1])
+        if cursor is not new_cursor:
+            close_table_cursor(new_cursor)
+
+    # The callbacks reading the same search fetch its pages one after the other
+    with cursor["lock"]:
+        while page_current not in cursor["pages"]:
+            known = max([page for page in cursor["after"] if page < page_current], default=-1)
+            if known >= 0 and not cursor["after"][known]:
+                # the last fetched page was the last page of the search
+                return [], cursor["total"]
+            body = {
+                "query": query,
+                "sort": sort,
+                "pit": {"id": cursor["pit"], "keep_alive": TABLE_PIT_KEEP_ALIVE},
+                "track_total_hits": True,
+                "_source": ["title_clean", "title", "published", "link"]
+            }
+            keep_rows = True
+            if known >= 0 and page_current - known <= TABLE_PREFETCH_PAGES + 1:
+                # The requested page is close to a fetched page: the search continues after this page
+                first, nb_pages = known + 1, page_current - known + TABLE_PREFETCH_PAGES
+                body["search_after"] = cursor["after"][known]
+            elif (page_current + TABLE_PREFETCH_PAGES + 1) * page_size <= TABLE_MAX_RESULT_WINDOW:
+                # The requested page is reached directly with from on the same point in time
+                first, nb_pages = page_current, TABLE_PREFETCH_PAGES + 1
+                body["from"] = page_current * page_size
+            else:
+                # Beyond max_result_window, the search walks to the page before the requested page with search_after,
+                # only the sort values of the articles are read
+                first = known + 1
+                nb_pages = min(page_current - first, TABLE_MAX_RESULT_WINDOW // page_size)
+                body["_source"] = False
+                keep_rows = False
+                if known >= 0:
+                    body["search_after"] = cursor["after"][known]
+            body["size"] = nb_pages * page_size
+
+            try:
+                result = es.search(body=body)
+            except exceptions.NotFoundError:
+                # The point in time has expired, the search starts again with a new one
+                cursor.update(open_table_cursor(index_name))
+                continue
+
+            cursor["pit"] = result["pit_id"]
+            cursor["total"] = result["hits"]["total"]["value"]
+            hits = result["hits"]["hits"]
+            for i in range(nb_pages):
+                page_hits = hits[i * page_size:(i + 1) * page_size]
+                page = first + i
+                if keep_rows:
+                    cursor["pages"][page] = data_table(page_hits, None) if page_hits else []
+                # an empty sort value marks the last page of the search
+                cursor["after"][page] = page_hits[-1]["sort"] if len(page_hits) == page_size else []
+                if not page_hits:
+                    break
+
+        # Only the pages around the requested page are kept
+        for page in [page for page in cursor["pages"] if abs(page - page_current) > TABLE_PREFETCH_PAGES]:
+            del cursor["pages"][page]
+        return cursor["pages"][page_current], cursor["total"]
+
+
+@cached_query(query_cache)
 def docs_per_source(start_date, end_date, index_name):
     """
         Function to calculate the number/percentage of articles for each source
@@ -275,74 +575,131 @@ def data_for_map_chart(data, previous_result):
 
 def locations_processing(data):
     """
-        Function to calculate the number of occurrences for a location
+        Function to calculate the number of occurrences for a location, the identical mentions (location, latitude,
+        longitude) are counted with a groupby, in linear time
         :param data: Elasticsearch result received from iterate_whole_es
         -> used for MAP CHART
     """
+    mentions = pd.DataFrame([(element["loc"], element["latitude"], element["longitude"])
+                             for element in data if len(element) == 3],
+                            columns=['Location', 'Latitude', 'Longitude'])
+
+    # Ignore the locations without coordinates
+    mentions = mentions[mentions['Latitude'].notna() & mentions['Longitude'].notna() &
+                        (mentions['Latitude'] != -1) & (mentions['Longitude'] != -1)]
+
+    # Count the mentions, the locations are kept in the order of their last mention
+    mentions = mentions.assign(position=range(len(mentions)))
+    df = mentions.groupby(['Location', 'Latitude', 'Longitude'], sort=False)['position'] \
+        .agg(Frequency='size', last='max').reset_index().sort_values('last')
+
+    return df[['Location', 'Frequency', 'Latitude', 'Longitude']].reset_index(drop=True)
+
+
+def exists_index(index_name):
+    """
+        Function to verify if an index exists
+        :param index_name: name of the Elasticsearch index
+    """
+    return es.indices.exists(index=index_name)
+
+
+@cached_query(query_cache)
+def top_locations(start_date, end_date, index_name, size=MAP_MAX_LOCATIONS, field="title"):
+    """
+        Function to determine the most frequent locations mentioned in a field with a single terms aggregation on the
+        side index of the locations (filled by main.py), the coordinates are given by a geo_centroid aggregation
+        :param start_date: start date
+        :param end_date: end date
+        :param index_name: name of the Elasticsearch index of the articles
+        :param size: maximum number of locations
+        :param field: title field or message field
+        -> used for MAP CHART
+    """
+    result = es.search(
+        index=index_name + "_locations",
+        body={
+            "query": {
+                "bool": {
+                    "filter": [
+                        {"range": {"published": {"gte": start_date, "lte": end_date}}},
+                        {"term": {"field": field}}
+                    ]
+                }
+            },
+            "size": 0,
+            "aggs": {
+                "locations": {
+                    "terms": {"field": "loc", "size": size},
+                    "aggs": {
+                        "coordinates": {"geo_centroid": {"field": "location"}}
+                    }
+                }
+            }
+        })
+
     loc = []
     freq = []
     lat = []
     lon = []
+    for bucket in result["aggregations"]["locations"]["buckets"]:
+        loc.append(bucket["key"])
+        freq.append(bucket["doc_count"])
+        lat.append(bucket["coordinates"]["location"]["lat"])
+        lon.append(bucket["coordinates"]["location"]["lon"])
 
-    for i in range(len(data)):
-        if data[i] not in data[i + 1:] and len(data[i]) == 3:
-            longitude = data[i]["longitude"]
-            latitude = data[i]["latitude"]
-            if (latitude is not None) and (longitude is not None):
-                if (latitude != -1) and (longitude != -1):
-                    loc.append(data[i]["loc"])
-                    freq.append(data.count(data[i]))
-                    lat.append(latitude)
-                    lon.append(longitude)
-            else:
-                continue
     return pd.DataFrame({'Location': loc, 'Frequency': freq, 'Latitude': lat, 'Longitude': lon})
 
 
 def data_for_bubble_chart(data, previous_result):
     """
-        Function to determine the most frequent words from data POS Tagging saved in Elasticsearch database
+        Function to count the most frequent words from data POS Tagging saved in Elasticsearch database, the words of
+        each chunk are added to a Counter per day so that the memory used depends on the vocabulary and not on the
+        number of articles
         :param data: Elasticsearch result received from iterate_whole_es
         :param previous_result: data of the previous iteration of iterate_whole_es
+        -> returns a dict {date: Counter of the words}
         -> used for BUBBLE CHART
     """
     if not previous_result:
-        previous_result = []
-
-    for element in data:
-        list_tokens = []
-        date = pd.to_datetime(element['_source']['published'], format='%Y-%m-%dT%H:%M:%S.%fZ').date()
-        for pos in element['_source']['pos_tag_title']:
-            if pos['pos_tag'] in ['ADJ', 'ADV', 'NOUN', 'NUM', 'PROPN', 'SYM', 'VERB']:
-                list_tokens.append(pos['token'])
+        previous_result = {}
 
-        for pos in element['_source']['pos_tag_message']:
-            if pos['pos_tag'] in ['ADJ', 'ADV', 'NOUN', 'NUM', 'PROPN', 'SYM', 'VERB']:
-                list_tokens.append(pos['token'])
+    # The dates of the chunk are converted together
+    published = parse_published([element['_source']['published'] for element in data])
 
-        previous_result.append({'date': date, 'tokens': list_tokens})
+    for element, date in zip(data, published.dt.date):
+        counter = previous_result.setdefault(date, Counter())
+        for field in ['pos_tag_title', 'pos_tag_message']:
+            counter.update(pos['token'] for pos in element['_source'][field]
+                           if pos['pos_tag'] in ['ADJ', 'ADV', 'NOUN', 'NUM', 'PROPN', 'SYM', 'VERB'])
     return previous_result
 
 
 def tokens_size(data):
     """
         Function to calculate the size of each token of data_for_bubble_chart function result
-        :param data: Elasticsearch result received from iterate_whole_es
+        :param data: dict {date: Counter of the words} received from iterate_whole_es (None if there is no article)
         -> used for BUBBLE CHART
     """
-    if data.empty:
-        df = {}
-    else:
-        df = data.groupby(['date'])['tokens'].sum().reset_index()
+    if not data:
+        data = {}
+
+    return bubble_sizes((day, data[day].most_common(15)) for day in sorted(data))
 
+
+def bubble_sizes(top_words):
+    """
+        Function to calculate the size of each word of the bubble chart
+        :param top_words: iterable of (date, list of the (word, number of occurrences) of the day in descending order)
+        -> used for BUBBLE CHART
+    """
     token = []
     real_score = []
     fake_score = []
     date = []
     rang = []
 
-    for x in range(len(df)):
-        word_occurrence = Counter(df['tokens'][x]).most_common(15)
+    for day, word_occurrence in top_words:
         i = 1
         # Size of the most frequent word
         standard_score = 26
@@ -353,7 +710,7 @@ def tokens_size(data):
             size_percentage = word[1] / big_one
             fake_score.append(standard_score * size_percentage)
             real_score.append(word[1])
-            date.append(df['date'][x])
+            date.append(day)
             rang.append(i)
             i += 1
 
@@ -361,6 +718,42 @@ def tokens_size(data):
         {'token': token, 'real_score': real_score, 'fake_score': fake_score, 'date': date, 'rang': rang})
 
 
+@cached_query(query_cache)
+def top_daily_tokens(start_date, end_date, index_name, size=15):
+    """
+        Function to determine the most frequent words of each day from the side index of the daily tokens (filled by
+        main.py with the most frequent words of each day), with a terms aggregation per day ordered by the counts
+        :param start_date: start date
+        :param end_date: end date
+        :param index_name: name of the Elasticsearch index of the articles
+        :param size: number of words per day
+        -> used for BUBBLE CHART
+    """
+    result = es.search(
+        index=index_name + "_daily_tokens",
+        body={
+            "query": {"range": {"day": {"gte": start_date, "lte": end_date}}},
+            "size": 0,
+            "aggs": {
+                "days": {
+                    "date_histogram": {"field": "day", "calendar_interval": "day", "min_doc_count": 1},
+                    "aggs": {
+                        "tokens": {
+                            "terms": {"field": "token", "size": size, "order": {"total": "desc"}},
+                            "aggs": {"total": {"sum": {"field": "count"}}}
+                        }
+                    }
+                }
+            }
+        })
+
+    buckets = result["aggregations"]["days"]["buckets"]
+    days = parse_published([bucket["key_as_string"] for bucket in buckets]).dt.date
+    return bubble_sizes((day, [(token["key"], int(token["total"]["value"])) for token in bucket["tokens"]["buckets"]])
+                        for day, bucket in zip(days, buckets))
+
+
+@cached_query(query_cache)
 def count_articles(index_name, start_date, end_date):
     """
         Function to calculate the number of articles published between two dates
@@ -380,74 +773,177 @@ def count_articles(index_name, start_date, end_date):
     return result['count']
 
 
-def cytoscape_data(start_date, end_date, file_name, links_file, value):
+def parse_ner_cell(cell):
+    """
+        Function to get the list of NERs of a cell of the NERs table
+        :param cell: list (array in the Parquet dataset), or list saved as a string in the csv file
+    """
+    if isinstance(cell, str):
+        return ast.literal_eval(cell)
+    if cell is None or (isinstance(cell, float) and math.isnan(cell)):
+        return []
+    return list(cell)
+
+
+def links_index(links):
+    """
+        Function to index the links of the organizations' wikipedia pages by organization (the first link is kept)
+        :param links: DataFrame of the links file
     """
-        Function to get data of network graph from csv file
+    links = links.drop_duplicates(subset=["org"])
+    return dict(zip(links['org'], links['link']))
+
+
+# Types of the nodes of each choice of the Dropdown: (outer type, inner type, True if the edge goes from outer to inner)
+NETWORK_CHOICES = {
+    0: ('organization', 'person', True),
+    1: ('organization', 'location', False),
+    2: ('person', 'location', True)
+}
+
+
+def network_elements(df, org_links, value, cooccurrence="day"):
+    """
+        Function to build the nodes and the weighted edges of the network graph, the NERs of each row are parsed once
+        and the nodes and edges are keyed in dicts
+        :param df: DataFrame of the NERs (NERs_org, NERs_per and NERs_loca columns)
+        :param org_links: dict {organization: link} returned by links_index
         :param value: list returned by the Dropdown (0 et/ou 1 et/or 2)
-        :param links_file: file containing links of organizations' wikipedia pages
-        :param start_date: start date
-        :param end_date: end date
-        :param file_name: name of the file containing NERs (ORG, LOC and PER)
+        :param cooccurrence: "day" to link all the NERs of the selected period, "article" to link only the NERs
+        mentioned in the same article
         -> used for NETWORK GRAPH/CYTOSCAPE
     """
+    rows = []
+    for org, per, loca in zip(df["NERs_org"], df["NERs_per"], df["NERs_loca"]):
+        rows.append({'organization': parse_ner_cell(org),
+                     'person': parse_ner_cell(per),
+                     'location': [loc["loc"] for loc in parse_ner_cell(loca)]})
+
+    nodes = {}
+    edges = Counter()
+
+    def add_node(name, classes):
+        link = org_links.get(name) if classes == 'organization' else ''
+        nodes.setdefault((name, classes), {'data': {'id': name, 'name': name, 'label': name, 'classes': classes,
+                                                    'link': link}})
+
+    def add_edges(outer, inner, outer_type, inner_type, outer_to_inner):
+        # the weight of an edge is the number of pairs of mentions of its two nodes
+        outer_count = Counter(outer)
+        inner_count = Counter(inner)
+        for name in outer_count:
+            add_node(name, outer_type)
+        if outer_count:
+            for name in inner_count:
+                add_node(name, inner_type)
+        for outer_name, outer_nb in outer_count.items():
+            for inner_name, inner_nb in inner_count.items():
+                edge = (outer_name, inner_name) if outer_to_inner else (inner_name, outer_name)
+                edges[edge] += outer_nb * inner_nb
+
+    for num in value:
+        outer_type, inner_type, outer_to_inner = NETWORK_CHOICES[num]
+        if cooccurrence == "article":
+            for row in rows:
+                add_edges(row[outer_type], row[inner_type], outer_type, inner_type, outer_to_inner)
+        else:
+            add_edges([name for row in rows for name in row[outer_type]],
+                      [name for row in rows for name in row[inner_type]], outer_type, inner_type, outer_to_inner)
+
+    return list(nodes.values()) + [{'data': {'source': source, 'target': target, 'weight': weight}}
+                                   for (source, target), weight in edges.items()]
+
+
+def load_table(file_name, loader):
+    """
+        Function to get a table loaded once in memory, it is loaded again with loader only if the file is modified
+        :param file_name: name of the file
+        :param loader: function loading the table from the file
+        -> used for NETWORK GRAPH/CYTOSCAPE
+    """
+    mtime = os.path.getmtime(file_name)
+    with table_store_lock:
+        entry = table_store.get(file_name)
+    if entry is not None and entry[0] == mtime:
+        return entry[1]
+
+    table = loader(file_name)
+    with table_store_lock:
+        table_store[file_name] = (mtime, table)
+    return table
+
+
+def load_ners_table(file_name):
+    """
+        Function to load the csv file of the NERs: the lists are parsed once, and the rows are indexed by their sorted
+        publication dates (UTC)
+        :param file_name: csv file of the NERs
+    """
     data = pd.read_csv(file_name)
-    mask = (data['date'] >= start_date) & (data['date'] < end_date)
-    df = data.loc[mask]
+    for column in ["NERs_org", "NERs_per", "NERs_loca"]:
+        data[column] = data[column].map(parse_ner_cell)
+    data.index = pd.DatetimeIndex(pd.to_datetime(data['date'], utc=True)).tz_convert(None)
+    return data.sort_index()
 
-    links = pd.read_csv(links_file)
-    links.drop_duplicates(subset=["org"], inplace=True)
 
-    nodes = []
-    edges = []
+def load_links_table(file_name):
+    """
+        Function to load the csv file of the links of organizations' wikipedia pages, indexed by organization
+        :param file_name: csv file of the links
+    """
+    return links_index(pd.read_csv(file_name))
 
-    for num in value:
-        match num:
-            case 0:
-                for line in df["NERs_org"]:
-                    line = ast.literal_eval(line)
-                    for org in line:
-                        nodes.append({'data': {'id': org, 'name': org, 'label': org, 'classes': 'organization',
-                                               'link': links[links['org'] == org].iloc[0]['link']}})
-                        for line2 in df["NERs_per"]:
-                            line2 = ast.literal_eval(line2)
-                            for per in line2:
-                                nodes.append({'data': {'id': per, 'name': per, 'label': per, 'classes': 'person',
-                                                       'link': ''}})
-                                edges.append({'data': {'source': org, 'target': per, 'weight': 0}})
-            case 1:
-                for line in df["NERs_org"]:
-                    line = ast.literal_eval(line)
-                    for org in line:
-                        nodes.append({'data': {'id': org, 'name': org, 'label': org, 'classes': 'organization',
-                                               'link': links[links['org'] == org].iloc[0]['link']}})
-                        for line3 in df["NERs_loca"]:
-                            line3 = ast.literal_eval(line3)
-                            for loc in line3:
-                                nodes.append({'data': {'id': loc["loc"], 'name': loc["loc"], 'label': loc["loc"],
-                                                       'classes': 'location', 'link': ''}})
-                                edges.append({'data': {'source': loc["loc"], 'target': org, 'weight': 0}})
-
-            case 2:
-                for line4 in df["NERs_per"]:
-                    line4 = ast.literal_eval(line4)
-                    for per in line4:
-                        nodes.append({'data': {'id': per, 'name': per, 'label': per, 'classes': 'person', 'link': ''}})
-                        for line5 in df["NERs_loca"]:
-                            line5 = ast.literal_eval(line5)
-                            for loc in line5:
-                                nodes.append({'data': {'id': loc["loc"], 'name': loc["loc"], 'label': loc["loc"],
-                                                       'classes': 'location', 'link': ''}})
-                                edges.append({'data': {'source': per, 'target': loc["loc"], 'weight': 0}})
-
-    new_nodes = []
-    for i in range(len(nodes)):
-        if nodes[i] not in nodes[i + 1:]:
-            new_nodes.append(nodes[i])
-
-    new_edges = []
-    for i in range(len(edges)):
-        if edges[i] not in edges[i + 1:]:
-            edges[i]['data']['weight'] = edges.count(edges[i])
-            new_edges.append(edges[i])
-
-    return new_nodes + new_edges
+
+def utc_timestamp(date):
+    """
+        Function to convert a date to a UTC timestamp without time zone, as the index of load_ners_table
+        :param date: date string
+    """
+    timestamp = pd.Timestamp(date)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert(None)
+    return timestamp
+
+
+def read_ners(file_name, start_date, end_date):
+    """
+        Function to read the NERs of the articles published between two dates, from the csv file (loaded once in memory)
+        or from the Parquet dataset partitioned by day (only the partitions of the selected days are read, with memory
+        mapping)
+        :param file_name: csv file or folder of the Parquet dataset of the NERs
+        :param start_date: start date
+        :param end_date: end date (excluded)
+        -> used for NETWORK GRAPH/CYTOSCAPE
+    """
+    if os.path.isdir(file_name):
+        # pyarrow is only needed by this storage of the NERs
+        import pyarrow.parquet as pq
+
+        days = [str(day.date()) for day in pd.date_range(start_date[:10], end_date[:10])]
+        data = pq.read_table(file_name, filters=[("day", "in", days)], memory_map=True).to_pandas()
+        mask = (data['date'] >= start_date) & (data['date'] < end_date)
+        return data.loc[mask]
+
+    # The csv file is kept in memory, and the period is found by a binary search in its sorted dates
+    data = load_table(file_name, load_ners_table)
+    start = data.index.searchsorted(utc_timestamp(start_date), side='left')
+    end = data.index.searchsorted(utc_timestamp(end_date), side='left')
+    return data.iloc[start:end]
+
+
+def cytoscape_data(start_date, end_date, file_name, links_file, value, cooccurrence="day"):
+    """
+        Function to get data of network graph from csv file or Parquet dataset
+        :param value: list returned by the Dropdown (0 et/ou 1 et/or 2)
+        :param links_file: file containing links of organizations' wikipedia pages
+        :param start_date: start date
+        :param end_date: end date
+        :param file_name: name of the file (or Parquet folder) containing NERs (ORG, LOC and PER)
+        :param cooccurrence: "day" to link all the NERs of the selected period, "article" to link only the NERs
+        mentioned in the same article
+        -> used for NETWORK GRAPH/CYTOSCAPE
+    """
+    df = read_ners(file_name, start_date, end_date)
+    org_links = load_table(links_file, load_links_table)
+
+    return network_elements(df, org_links, value, cooccurrence)
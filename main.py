@@ -1,8 +1,12 @@
+import os
+import sys
 import time
 
-from file import json_to_es_with_bulk, iterate_whole_es, pos_tag_field, ner_person_field, ner_loc_field, \
-    ner_org_field, wiki_field, ner_to_csv, iterate_whole_es_2, delete_index, merge_csv_files, delete_csv_file, \
-    links_in_csv
+from file import bulk_load, run_stage, print_stages_status, annotate_fields, wiki_field, ner_to_csv, \
+    iterate_whole_es_2, delete_index, merge_csv_files, delete_csv_file, links_in_csv, create_index, \
+    locations_index_name, locations_to_index, LOCATIONS_MAPPING, ners_to_parquet, clean_fields, CLEAN_FIELDS, \
+    daily_tokens_index_name, daily_tokens_to_index, DAILY_TOKENS_MAPPING, article_tokens_index_name, \
+    ARTICLE_TOKENS_MAPPING
 
 start_time = time.time()
 
@@ -11,77 +15,97 @@ index_name = "livrons_journaux"
 index_type = "message_logs"
 body = {"query": {"match_all": {}}}
 
+# Number of worker processes used for the POS tagging and the NERs
+slices = os.cpu_count()
+
+
+def stop_if_failed(finished):
+    """
+        Function to stop main.py when a stage did not finish, the next stages and the exports read the fields written
+        by this stage (the failed chunk is resumed at the next run)
+        :param finished: value returned by run_stage
+    """
+    if not finished:
+        print_stages_status()
+        sys.exit(">> A stage did not finish : run main.py again to resume it")
+
 
 """# Delete index if it exists
 print(">> Delete index : in progress ...")
 delete_index("livrons_journaux")
 
 
-# load json data into Elasticsearch
+# load json data into Elasticsearch, in an index created with an explicit mapping and tuned for the load
 print(">> JSON file loading : in progress ...")
-json_to_es_with_bulk("json_files/lyon_journaux_data.json")
+bulk_load("json_files/lyon_journaux_data.json", index_name)
 print(">> JSON file loading : finished !")"""
 
 
-# Generate the POS tagging for the TITLE field
-body_1 = {"bool": {"must_not": {"exists": {"field": "pos_tag_title"}}}}
-print(">> Processing POS tagging for TITLE field : in progress ... ")
-iterate_whole_es(index_name, index_type, 1000, pos_tag_field, body_1, "title")
-print(">> Processing POS tagging for TITLE field : finished !")
-
-
-# Generate the POS tagging for the MESSAGE field
-body_2 = {"bool": {"must_not": {"exists": {"field": "pos_tag_message"}}}}
-print(">> Processing POS tagging for MESSAGE field : in progress ... ")
-iterate_whole_es(index_name, index_type, 1000, pos_tag_field, body_2, "message")
-print(">> Processing POS tagging for MESSAGE field : finished !")
-
-
-# Generate the NER of type "PER" for the TITLE and MESSAGE fields
-body_3 = {"bool": {"must_not": {"exists": {"field": "ner_per_title"}}}}
-print(">> Processing NER_PER for TITLE field : in progress ... ")
-iterate_whole_es(index_name, index_type, 1000, ner_person_field, body_3, "title")
-print(">> Processing NER_PER for TITLE field : finished !")
-
-body_4 = {"bool": {"must_not": {"exists": {"field": "ner_per_message"}}}}
-print(">> Processing NER_PER for MESSAGE field : in progress ... ")
-iterate_whole_es(index_name, index_type, 1000, ner_person_field, body_4, "message")
-print(">> Processing NER_PER for MESSAGE field : finished !")
-
-
-# Generate the NER of type "ORG" for the TITLE and MESSAGE fields
-body_5 = {"bool": {"must_not": {"exists": {"field": "ner_org_title"}}}}
-print(">> Processing NER_ORG for TITLE field : in progress ... ")
-iterate_whole_es(index_name, index_type, 1000, ner_org_field, body_5, "title")
-print(">> Processing NER_ORG for TITLE field : finished !")
-
-body_6 = {"bool": {"must_not": {"exists": {"field": "ner_org_message"}}}}
-print(">> Processing NER_ORG for MESSAGE field : in progress ... ")
-iterate_whole_es(index_name, index_type, 1000, ner_org_field, body_6, "message")
-print(">> Processing NER_ORG for MESSAGE field : finished !")
-
-
-# Generate the NER of type "LOC" for the TITLE and MESSAGE fields
-body_7 = {"bool": {"must_not": {"exists": {"field": "ner_loca_title"}}}}
-print(">> Processing NER_LOC for TITLE field : in progress ... ")
-iterate_whole_es(index_name, index_type, 1000, ner_loc_field, body_7, "title")
-print(">> Processing NER_LOC for TITLE field : finished !")
-
-body_8 = {"bool": {"must_not": {"exists": {"field": "ner_loca_message"}}}}
-print(">> Processing NER_LOC for MESSAGE field : in progress ... ")
-iterate_whole_es(index_name, index_type, 1000, ner_loc_field, body_8, "message")
-print(">> Processing NER_LOC for MESSAGE field : finished !")
-
-
-# Search the definitions and the wikipedia pages of the "ORG" type terms of the TITLE and MESSAGE fields
-body_9 = {"bool": {"must_not": {"exists": {"field": "wiki_title"}}}}
+# The stages below are checkpointed by index in cache_files/checkpoints.json: an interrupted or failed stage is resumed,
+# and a finished stage only processes the new documents (use reset_stage to run a stage again). main.py stops at the
+# first stage that did not finish, the next stages need its fields
+
+# Create the side index of the locations, filled with the geocoded "LOC" type terms by the stages below
+create_index(locations_index_name(index_name), LOCATIONS_MAPPING)
+
+# Copy the locations of the documents processed before the creation of the side index (once, the locations of the
+# documents processed later are added by the annotate stage)
+body_0 = {"query": {"exists": {"field": "ner_loca_title"}},
+          "_source": ["published", "ner_loca_title", "ner_loca_message"]}
+print(">> Indexing the locations in the side index : in progress ... ")
+stop_if_failed(run_stage("locations_index", index_name, index_type, 10000, locations_to_index, body_0,
+                         ["title", "message"], recheck=False))
+print(">> Indexing the locations in the side index : finished !")
+
+# Create the side indexes of the words of the articles and of the most frequent words of each day, filled with the words
+# of the POS tagging by the stages below, then add the words of the documents processed before their creation (once, as
+# for the locations)
+create_index(article_tokens_index_name(index_name), ARTICLE_TOKENS_MAPPING)
+create_index(daily_tokens_index_name(index_name), DAILY_TOKENS_MAPPING)
+body_tokens = {"query": {"exists": {"field": "pos_tag_title"}},
+               "_source": ["published", "pos_tag_title", "pos_tag_message"]}
+print(">> Indexing the daily tokens in the side index : in progress ... ")
+stop_if_failed(run_stage("daily_tokens_index", index_name, index_type, 10000, daily_tokens_to_index, body_tokens,
+                         ["title", "message"], recheck=False))
+print(">> Indexing the daily tokens in the side index : finished !")
+
+
+# Save the cleaned texts of the TITLE and MESSAGE fields of the documents loaded before the "_clean" fields (the new
+# documents get them at the load), the "_clean" fields are not indexed so the documents are selected with the "cleaned"
+# marker
+body_clean = {"query": {"bool": {"must_not": {"exists": {"field": "cleaned"}}}},
+              "_source": CLEAN_FIELDS}
+print(">> Cleaning TITLE and MESSAGE fields : in progress ... ")
+stop_if_failed(run_stage("clean", index_name, index_type, 10000, clean_fields, body_clean, CLEAN_FIELDS, slices))
+print(">> Cleaning TITLE and MESSAGE fields : finished !")
+
+
+# Generate the POS tagging and the NERs of type "PER", "ORG" and "LOC" for the TITLE and MESSAGE fields, each document
+# is processed once: the processed documents are marked with "annotated" (the NER fields can not be used since an
+# empty list is not found by "exists"), and the documents processed before this marker have a POS tagging of the title
+body_1 = {"query": {"bool": {"must_not": [{"exists": {"field": "annotated"}}, {"exists": {"field": "pos_tag_title"}}]}}}
+print(">> Processing POS tagging and NERs for TITLE and MESSAGE fields : in progress ... ")
+stop_if_failed(run_stage("annotate", index_name, index_type, 1000, annotate_fields, body_1, ["title", "message"],
+                         slices))
+print(">> Processing POS tagging and NERs for TITLE and MESSAGE fields : finished !")
+
+
+# Search the definitions and the wikipedia pages of the "ORG" type terms of the TITLE and MESSAGE fields, only in the
+# annotated documents (the documents processed before the "annotated" marker have a POS tagging of the title). The
+# processed documents are marked with "wikied_<field>" (an empty wiki_ list is not found by "exists"), and the documents
+# processed before this marker have a non-empty wiki_ field
+annotated = {"bool": {"should": [{"exists": {"field": "annotated"}}, {"exists": {"field": "pos_tag_title"}}]}}
+body_9 = {"query": {"bool": {"filter": annotated,
+                             "must_not": [{"exists": {"field": "wikied_title"}}, {"exists": {"field": "wiki_title"}}]}}}
 print(">> Loading wikipedia data for TITLE field : in progress ... ")
-iterate_whole_es(index_name, index_type, 10000, wiki_field, body_9, "title")
+stop_if_failed(run_stage("wiki_title", index_name, index_type, 10000, wiki_field, body_9, "title"))
 print(">> Loading wikipedia data for TITLE field : finished !")
 
-body_10 = {"bool": {"must_not": {"exists": {"field": "wiki_message"}}}}
+body_10 = {"query": {"bool": {"filter": annotated,
+                              "must_not": [{"exists": {"field": "wikied_message"}},
+                                           {"exists": {"field": "wiki_message"}}]}}}
 print(">> Loading wikipedia data for MESSAGE field : in progress ... ")
-iterate_whole_es(index_name, index_type, 10000, wiki_field, body_10, "message")
+stop_if_failed(run_stage("wiki_message", index_name, index_type, 10000, wiki_field, body_10, "message"))
 print(">> Loading wikipedia data for MESSAGE field  : finished !")
 
 
@@ -119,4 +143,16 @@ merge_csv_files("csv_files/organizations.csv", "csv_files/locations.csv", "csv_f
 print(">> Merge csv files : finished !")
 
 
+# Save the NERs in a Parquet dataset partitioned by day, read by the network graph instead of the csv file (only if the
+# optional pyarrow library is installed)
+print(">> Save NERs in a Parquet dataset : in progress ... ")
+try:
+    ners_to_parquet("csv_files/NERs.csv", "csv_files/NERs_parquet")
+    print(">> Save NERs in a Parquet dataset : finished !")
+except ImportError:
+    print(">> Save NERs in a Parquet dataset : skipped, pyarrow is not installed (the network graph reads the csv "
+          "file)")
+
+
+print_stages_status()
 print(">>> Execution time of main.py : ", time.time() - start_time)